@@ -0,0 +1,522 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015-2021 Johan Winge
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measurements of the speed and size of various parts of the macronizer. Usage:
+    python benchmark.py dbschema
+    python benchmark.py wordlist
+    python benchmark.py concurrency
+    python benchmark.py lemmas
+    python benchmark.py tagdistance
+    python benchmark.py getaccents
+    python benchmark.py align
+    python benchmark.py characters"""
+
+import os
+import re
+import shutil
+import sqlite3
+import random
+import tempfile
+import time
+import argparse
+import tracemalloc
+import multiprocessing
+import subprocess
+import sys
+import pprint
+import cProfile
+import pstats
+import functools
+from collections import defaultdict
+
+import macronizer
+
+
+def timed(function, *args):
+    starttime = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - starttime
+# enddef
+
+
+def bench_dbschema(args):
+    """Compare the size and lookup speed of the plain and the compact database layouts."""
+    dbconn = sqlite3.connect(macronizer.DB_NAME)
+    wordforms = [wordform for (wordform,) in dbconn.execute("SELECT DISTINCT wordform FROM morpheus")]
+    dbconn.close()
+    random.seed(0)
+    sample = random.sample(wordforms, min(args.samplesize, len(wordforms)))
+    tempdir = tempfile.mkdtemp()
+    plaindb = os.path.join(tempdir, 'plain.db')
+    compactdb = os.path.join(tempdir, 'compact.db')
+    shutil.copy(macronizer.DB_NAME, plaindb)
+    shutil.copy(macronizer.DB_NAME, compactdb)
+    macronizer.DB_NAME = compactdb
+    macronizer.Wordlist().compactdatabase()
+    print("%-8s %12s %14s %14s" % ("layout", "size (MB)", "single (us)", "bulk (us)"))
+    for (name, dbname) in [("plain", plaindb), ("compact", compactdb)]:
+        macronizer.DB_NAME = dbname
+        wordlist = macronizer.Wordlist()
+        single = timed(lambda: [wordlist.loadwordfromdb(wordform) for wordform in sample])
+        wordlist = macronizer.Wordlist()
+        bulk = timed(wordlist.loadwordsfromdb, sample)
+        print("%-8s %12.1f %14.1f %14.1f" % (name, os.path.getsize(dbname) / 1e6,
+                                            single / len(sample) * 1e6, bulk / len(sample) * 1e6))
+    shutil.rmtree(tempdir)
+# enddef
+
+
+def bench_wordlist(args):
+    """Compare the memory used per cached word form by the old parallel dictionaries and the Wordlist records."""
+    tempdir = tempfile.mkdtemp()
+    samplefile = os.path.join(tempdir, 'macrons.txt')
+    with open(macronizer.MACRONS_FILE, 'r', encoding='utf-8') as plaindbfile, \
+         open(samplefile, 'w', encoding='utf-8') as samplelexicon:
+        for (i, line) in enumerate(plaindbfile):
+            if i == args.samplesize:
+                break
+            samplelexicon.write(line)
+
+    def olddictionaries():
+        formtolemmas = defaultdict(list)
+        formtoaccenteds = defaultdict(list)
+        formtotaglemmaaccents = defaultdict(list)
+        with open(samplefile, 'r', encoding='utf-8') as plaindbfile:
+            for line in plaindbfile:
+                [wordform, morphtag, lemma, accented] = line.split()
+                formtolemmas[wordform].append(lemma)
+                formtoaccenteds[wordform].append(accented.lower())
+                formtotaglemmaaccents[wordform].append((morphtag, lemma, accented))
+        return formtolemmas, formtoaccenteds, formtotaglemmaaccents
+
+    def wordlistrecords():
+        macronizer.USE_DB = False
+        macronizer.USE_LEXICON_FILE = False
+        macronizer.MACRONS_FILE = samplefile
+        return macronizer.Wordlist()
+
+    print("%-12s %10s %14s" % ("structure", "forms", "bytes/form"))
+    for (name, build) in [("dictionaries", olddictionaries), ("records", wordlistrecords)]:
+        tracemalloc.start()
+        structure = build()
+        (used, _) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        numforms = len(structure[0]) if isinstance(structure, tuple) else len(structure.forms)
+        print("%-12s %10i %14.1f" % (name, numforms, used / numforms))
+        del structure
+    shutil.rmtree(tempdir)
+# enddef
+
+
+def concurrencyworker(dbname, workerindex, sample, iterations, results):
+    macronizer.DB_NAME = dbname
+    macronizer.WORDLIST_CACHE_SIZE = 0
+    errors = 0
+    starttime = time.perf_counter()
+    try:
+        wordlist = macronizer.Wordlist(multiprocess=True)
+        for i in range(iterations):
+            try:
+                wordlist.trimcache()
+                wordlist.loadwordsfromdb(random.sample(sample, min(100, len(sample))))
+                wordlist.dbwriter.write([("stress%i_%i" % (workerindex, i), "n-s---mn-", "stress", "stre_ss")])
+            except Exception as inst:
+                sys.stderr.write("Worker %i: %s\n" % (workerindex, inst))
+                errors += 1
+        wordlist.close()
+    except Exception as inst:
+        sys.stderr.write("Worker %i: %s\n" % (workerindex, inst))
+        errors += 1
+    results.put((errors, time.perf_counter() - starttime))
+# enddef
+
+
+def bench_concurrency(args):
+    """Let many processes look up and store words in the same database at the same time, and check that
+    every write arrives without any "database is locked" errors."""
+    dbconn = sqlite3.connect(macronizer.DB_NAME)
+    wordforms = [wordform for (wordform,) in dbconn.execute("SELECT DISTINCT wordform FROM morpheus LIMIT 100000")]
+    dbconn.close()
+    tempdir = tempfile.mkdtemp()
+    dbname = os.path.join(tempdir, 'stress.db')
+    shutil.copy(macronizer.DB_NAME, dbname)
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=concurrencyworker,
+                                       args=(dbname, i, wordforms, args.iterations, results))
+               for i in range(args.workers)]
+    starttime = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    outcomes = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - starttime
+    dbconn = sqlite3.connect(dbname)
+    (stored,) = dbconn.execute("SELECT COUNT(DISTINCT wordform) FROM morpheus WHERE wordform LIKE 'stress%'").fetchone()
+    dbconn.close()
+    shutil.rmtree(tempdir)
+    errors = sum(errors for (errors, _) in outcomes)
+    failedworkers = sum(1 for worker in workers if worker.exitcode != 0)
+    print("workers: %i, iterations each: %i" % (args.workers, args.iterations))
+    print("errors: %i" % errors)
+    print("words stored: %i of %i" % (stored, args.workers * args.iterations))
+    print("lookup batches per second: %.1f" % (args.workers * args.iterations / elapsed))
+    if errors > 0 or failedworkers > 0 or stored != args.workers * args.iterations:
+        sys.exit("FAILED: %i errors, %i workers exited abnormally, %i words not stored" %
+                 (errors, failedworkers, args.workers * args.iterations - stored))
+# enddef
+
+
+LEMMAS_MODULE_PROBE = """
+import resource, sys, time
+sys.path.insert(0, %r)
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+starttime = time.perf_counter()
+from lemmas import lemma_frequency, word_lemma_freq, wordform_to_corpus_lemmas
+loaded = time.perf_counter()
+for wordform in %r:
+    for lemma in wordform_to_corpus_lemmas.get(wordform, []):
+        word_lemma_freq[(wordform, lemma)]
+print(loaded - starttime, time.perf_counter() - loaded,
+      resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline)
+"""
+
+LEMMAS_TABLE_PROBE = """
+import resource, sys, time
+sys.path.insert(0, %r)
+import macronizer
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+starttime = time.perf_counter()
+corpuslemmas = macronizer.MappedTable(macronizer.CORPUS_LEMMAS_FILE)
+lemmafrequencies = macronizer.MappedTable(macronizer.LEMMA_FREQUENCIES_FILE)
+loaded = time.perf_counter()
+for wordform in %r:
+    corpuslemmas.get(wordform)
+print(loaded - starttime, time.perf_counter() - loaded,
+      resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline)
+"""
+
+
+def bench_lemmas(args):
+    """Compare the startup time and memory of the old lemmas.py module with the memory mapped lemma tables.
+    The module is regenerated from ldt-corpus.txt the way extractlexicon.py used to do it."""
+    lemma_frequency = defaultdict(int)
+    word_lemma_freq = defaultdict(int)
+    wordform_to_corpus_lemmas = defaultdict(list)
+    with open('ldt-corpus.txt', 'r', encoding='utf-8') as pos_corpus_file:
+        for line in pos_corpus_file:
+            if '\t' in line:
+                [wordform, _, lemma] = line.strip().split('\t')
+                lemma_frequency[lemma] += 1
+                word_lemma_freq[(wordform, lemma)] += 1
+                if lemma not in wordform_to_corpus_lemmas[wordform]:
+                    wordform_to_corpus_lemmas[wordform].append(lemma)
+    tempdir = tempfile.mkdtemp()
+    pp = pprint.PrettyPrinter()
+    with open(os.path.join(tempdir, 'lemmas.py'), 'w', encoding='utf-8') as lemma_file:
+        lemma_file.write('lemma_frequency = %s\n' % pp.pformat(dict(lemma_frequency)))
+        lemma_file.write('word_lemma_freq = %s\n' % pp.pformat(dict(word_lemma_freq)))
+        lemma_file.write('wordform_to_corpus_lemmas = %s\n' % pp.pformat(dict(wordform_to_corpus_lemmas)))
+    random.seed(0)
+    sample = random.sample(sorted(wordform_to_corpus_lemmas), min(args.samplesize, len(wordform_to_corpus_lemmas)))
+    print("%-22s %12s %14s %12s" % ("store", "startup (ms)", "lookups (ms)", "RSS (MB)"))
+    libdir = os.path.dirname(os.path.abspath(macronizer.__file__))
+    for (name, probe, path) in [("lemmas.py (first run)", LEMMAS_MODULE_PROBE, tempdir),
+                                ("lemmas.py (second run)", LEMMAS_MODULE_PROBE, tempdir),
+                                ("mapped tables", LEMMAS_TABLE_PROBE, libdir)]:
+        output = subprocess.check_output([sys.executable, "-c", probe % (path, sample)], universal_newlines=True)
+        (startup, lookups, rss) = output.split()
+        print("%-22s %12.1f %14.1f %12.1f" % (name, float(startup) * 1000, float(lookups) * 1000, int(rss) / 1024))
+    shutil.rmtree(tempdir)
+# enddef
+
+
+def bench_tagdistance(args):
+    """Compare postags.tag_distance with the TagDistances table on the candidate sets of ambiguous word forms
+    in macrons.txt, taking one of the candidate tags of each form as the tag given by the tagger."""
+    formtotags = defaultdict(list)
+    with open(macronizer.MACRONS_FILE, 'r', encoding='utf-8') as plaindbfile:
+        for line in plaindbfile:
+            [wordform, morphtag, _, _] = line.split()
+            formtotags[wordform].append(morphtag)
+    random.seed(0)
+    candidatesets = [(random.choice(tags), tags) for tags in formtotags.values() if len(tags) > 1]
+    candidatesets = random.sample(candidatesets, min(args.samplesize, len(candidatesets)))
+    numcandidates = sum(len(tags) for (_, tags) in candidatesets)
+    tagdistances = macronizer.TagDistances()
+    print("%-16s %14s" % ("method", "ns/candidate"))
+    for (name, distance) in [("tag_distance", macronizer.postags.tag_distance),
+                             ("table (cold)", tagdistances.distance),
+                             ("table (warm)", tagdistances.distance)]:
+        elapsed = timed(lambda: [distance(tag, lextag) for (tag, tags) in candidatesets for lextag in tags])
+        print("%-16s %14.1f" % (name, elapsed / numcandidates * 1e9))
+    assert all(tagdistances.distance(tag, lextag) == macronizer.postags.tag_distance(tag, lextag)
+               for (tag, tags) in candidatesets for lextag in tags)
+    print("%i distinct tags, %i rows" % (len(tagdistances.ids), len(tagdistances.rows)))
+# enddef
+
+
+def oldlevenshtein(s1, s2):
+    """The full matrix edit distance that getaccents used before."""
+    if len(s1) < len(s2):
+        return oldlevenshtein(s2, s1)
+    if len(s2) == 0:
+        return len(s1)
+    previous_row = range(len(s2) + 1)
+    for i, c1 in enumerate(s1):
+        current_row = [i + 1]
+        for j, c2 in enumerate(s2):
+            insertions = previous_row[j + 1] + 1
+            deletions = current_row[j] + 1
+            substitutions = previous_row[j] + (c1 != c2)
+            current_row.append(min(insertions, deletions, substitutions))
+        previous_row = current_row
+    return previous_row[-1]
+# enddef
+
+
+def bench_getaccents(args):
+    """Profile getaccents on distinct ambiguous word forms from macrons.txt, tagged and lemmatized with one of
+    their own parses, and report how much of the time is spent computing lemma distances."""
+    macronizer.USE_DB = False
+    macronizer.USE_LEXICON_FILE = False
+    wordlist = macronizer.Wordlist()
+    random.seed(0)
+    ambiguous = [wordform for (wordform, parses) in wordlist.forms.items()
+                 if len(set(accented for (_, _, accented) in parses)) > 1 and wordform.isalpha()]
+    sample = random.sample(ambiguous, min(args.samplesize, len(ambiguous)))
+    tokenization = macronizer.Tokenization(" ".join(sample))
+    for token in tokenization.tokens:
+        if token.isword:
+            (token.tag, token.lemma, _) = random.choice(wordlist.taglemmaaccents(token.text.lower()))
+    print("%-16s %12s %16s %8s" % ("levenshtein", "total (s)", "levenshtein (s)", "share"))
+    cachedlevenshtein = functools.lru_cache(maxsize=macronizer.LEMMA_DISTANCE_CACHE_SIZE)(macronizer.levenshtein)
+    for (name, function) in [("old", oldlevenshtein), ("banded, cached", cachedlevenshtein)]:
+        wordlist.lemmadistance = function
+        wordlist.rankings.clear()
+        wordlist.tagdistances = macronizer.TagDistances()
+        profile = cProfile.Profile()
+        profile.runcall(tokenization.getaccents, wordlist)
+        stats = pstats.Stats(profile)
+        total = stats.total_tt
+        levenshteintime = sum(cumtime for ((_, _, functionname), (_, _, _, cumtime, _)) in stats.stats.items()
+                              if functionname == function.__name__)
+        print("%-16s %12.2f %16.2f %7.1f%%" % (name, total, levenshteintime, 100 * levenshteintime / total))
+# enddef
+
+
+def oldalignaccented(plain, accented, domacronize, performutov, performitoj):
+    """The list of lists dynamic programming that Token.macronize used before."""
+
+    def inscost(a):
+        if a == '_':
+            return 0
+        return 2
+
+    def subcost(p, a):
+        if a == '_':
+            return 100
+        if (a in "IJij" and p in "IJij") or (a in "UVuv" and p in "UVuv"):
+            return 1
+        return 2
+
+    def delcost(_):
+        return 2
+
+    n = len(plain) + 1
+    m = len(accented) + 1
+    distance = [[0 for i in range(m)] for j in range(n)]
+    for i in range(1, n):
+        distance[i][0] = distance[i-1][0] + delcost(plain[i-1])
+    for j in range(1, m):
+        distance[0][j] = distance[0][j-1] + inscost(accented[j-1])
+    for i in range(1, n):
+        for j in range(1, m):
+            if macronizer.toascii(plain[i-1].lower()) == macronizer.toascii(accented[j-1].lower()):
+                distance[i][j] = distance[i-1][j-1]
+            else:
+                rghtcost = distance[i-1][j] + delcost(plain[i-1])
+                diagcost = distance[i-1][j-1] + subcost(plain[i-1], accented[j-1])
+                downcost = distance[i][j-1] + inscost(accented[j-1])
+                distance[i][j] = min(rghtcost, diagcost, downcost)
+    result = ""
+    while i != 0 and j != 0:
+        upcost = distance[i][j-1] if j > 0 else 1000
+        diagcost = distance[i-1][j-1] if j > 0 and i > 0 else 1000
+        leftcost = distance[i-1][j] if i > 0 else 1000
+        if diagcost <= upcost and diagcost < leftcost:  # To-do: review the comparisons...
+            i -= 1
+            j -= 1
+            if performutov and accented[j].lower() == 'v' and plain[i] == 'u':
+                result = 'v' + result
+            elif performutov and accented[j].lower() == 'v' and plain[i] == 'U':
+                result = 'V' + result
+            elif performitoj and accented[j].lower() == 'j' and plain[i] == 'i':
+                result = 'j' + result
+            elif performitoj and accented[j].lower() == 'j' and plain[i] == 'I':
+                result = 'J' + result
+            else:
+                result = plain[i] + result
+        elif upcost <= diagcost and upcost <= leftcost:
+            j -= 1
+            if domacronize and accented[j] == '_':
+                result = "_" + result
+        else:
+            i -= 1
+            result = plain[i] + result
+    # Some strange morpheus output (e.g. de_e_recti_) may give an additional _ in the result:
+    result = result.replace("__", "_")
+    return result
+# enddef
+
+
+def bench_align(args):
+    """Compare the throughput of the old and the new alignment in Token.macronize, on accented forms from
+    macrons.txt paired with plain texts in u orthography with random capitalization, and check that they agree."""
+    random.seed(0)
+    with open(macronizer.MACRONS_FILE, 'r', encoding='utf-8') as plaindbfile:
+        accenteds = [line.split()[3].replace("_^", "").replace("^", "") for line in plaindbfile]
+    accenteds = random.sample(accenteds, min(args.samplesize, len(accenteds)))
+    pairs = []
+    for accented in accenteds:
+        plain = macronizer.touiorthography(accented.replace("_", ""))
+        if random.random() < 0.2:
+            plain = plain.capitalize()
+        pairs.append((plain, accented))
+    print("%-14s %16s" % ("alignment", "tokens/second"))
+    for (name, function) in [("old", oldalignaccented), ("flat array DP", macronizer.alignaccenteddp),
+                             ("new", macronizer.alignaccented)]:
+        elapsed = timed(lambda: [function(plain, accented, True, True, True) for (plain, accented) in pairs])
+        print("%-14s %16.0f" % (name, len(pairs) / elapsed))
+    linear = sum(1 for (plain, accented) in pairs
+                 if macronizer.alignaccentedlinear(plain, accented, True, True, True) is not None)
+    print("%.1f%% aligned without the dynamic programming" % (100 * linear / len(pairs)))
+    for flags in [(True, False, False), (True, True, True), (False, True, False)]:
+        assert all(oldalignaccented(plain, accented, *flags) == macronizer.alignaccented(plain, accented, *flags)
+                   for (plain, accented) in pairs)
+# enddef
+
+
+# The sequential replacements that the character mapping functions used before:
+
+def oldunicodeaccents(txt):
+    for source, replacement in [("a_", "ā"), ("e_", "ē"), ("i_", "ī"), ("o_", "ō"), ("u_", "ū"), ("y_", "ȳ"),
+                                ("A_", "Ā"), ("E_", "Ē"), ("I_", "Ī"), ("O_", "Ō"), ("U_", "Ū"), ("Y_", "Ȳ"),
+                                ("ä_", "ā"), ("ë_", "ē"), ("ï_", "ī"), ("ö_", "ō"), ("ü_", "ū"), ("ÿ_", "ȳ"),
+                                ("æ_", "æ"), ("œ_", "œ"), ("Æ_", "Æ"), ("Œ_", "Œ")]:
+        txt = txt.replace(source, replacement)
+    return txt
+# enddef
+
+
+def oldescape_macrons(txt):
+    for source, replacement in [("ā", "a_"), ("ē", "e_"), ("ī", "i_"), ("ō", "o_"), ("ū", "u_"), ("ȳ", "y_"),
+                                ("Ā", "A_"), ("Ē", "E_"), ("Ī", "I_"), ("Ō", "O_"), ("Ū", "U_"), ("Ȳ", "Y_")]:
+        txt = txt.replace(source, replacement)
+    return txt
+# enddef
+
+
+def oldremovemacrons(txt):
+    for source, replacement in [("ā", "a"), ("ē", "e"), ("ī", "i"), ("ō", "o"), ("ū", "u"), ("ȳ", "y"),
+                                ("Ā", "A"), ("Ē", "E"), ("Ī", "I"), ("Ō", "O"), ("Ū", "U"), ("Ȳ", "Y")]:
+        txt = txt.replace(source, replacement)
+    return txt
+# enddef
+
+
+def oldtoascii(txt):
+    for source, replacement in [("æ", "ae"), ("Æ", "Ae"), ("œ", "oe"), ("Œ", "Oe"),
+                                ("ä", "a"), ("ë", "e"), ("ï", "i"), ("ö", "o"), ("ü", "u"), ("ÿ", "u")]:
+        txt = txt.replace(source, replacement)
+    return txt
+# enddef
+
+
+def oldtouiorthography(txt):
+    for source, replacement in [("v", "u"), ("U", "V"), ("j", "i"), ("J", "I")]:
+        txt = txt.replace(source, replacement)
+    return txt
+# enddef
+
+
+def bench_characters(args):
+    """Check that the character mapping functions give the same results as before, on random strings of the
+    characters they map, and compare their speed on random words."""
+    postags = macronizer.postags
+    functions = [("unicodeaccents", oldunicodeaccents, postags.unicodeaccents),
+                 ("escape_macrons", oldescape_macrons, postags.escape_macrons),
+                 ("removemacrons", oldremovemacrons, postags.removemacrons),
+                 ("toascii", oldtoascii, macronizer.toascii),
+                 ("touiorthography", oldtouiorthography, macronizer.touiorthography)]
+    random.seed(0)
+    specials = "_aeiouyAEIOUYäëïöüÿæœÆŒāēīōūȳĀĒĪŌŪȲvVjJ"
+    for _ in range(args.samplesize):
+        txt = "".join(random.choice(specials + "bcx ") for _ in range(random.randint(0, 20)))
+        for (name, oldfunction, function) in functions:
+            assert oldfunction(txt) == function(txt), (name, txt)
+    print("%i random strings give the same results" % args.samplesize)
+    words = []
+    for _ in range(args.samplesize):
+        word = "".join(random.choice("aeiouy" if i % 2 else "bcdfgjlmnpqrstuvx") for i in range(random.randint(2, 10)))
+        words.append(re.sub("([aeiouy])", lambda match: match.group() + "_" if random.random() < 0.3 else match.group(),
+                            word.capitalize() if random.random() < 0.2 else word))
+    # Each function gets the kind of text it is used on: escaped or Unicode accented forms, or plain text
+    # (which sometimes has a ligature):
+    samples = {"unicodeaccents": words, "escape_macrons": [oldunicodeaccents(word) for word in words]}
+    plainwords = [word.replace("_", "").replace("ae", "æ" if random.random() < 0.1 else "ae") for word in words]
+    print("%-16s %12s %12s" % ("function", "old (ns)", "new (ns)"))
+    for (name, oldfunction, function) in functions:
+        sample = samples.get(name, plainwords)
+        oldtime = timed(lambda: [oldfunction(word) for word in sample])
+        newtime = timed(lambda: [function(word) for word in sample])
+        print("%-16s %12.0f %12.0f" % (name, oldtime / len(sample) * 1e9, newtime / len(sample) * 1e9))
+# enddef
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+    dbschema_parser = subparsers.add_parser("dbschema", help="size and lookup latency of the database layouts")
+    dbschema_parser.add_argument("--samplesize", type=int, default=20000, help="number of word forms to look up")
+    dbschema_parser.set_defaults(function=bench_dbschema)
+    wordlist_parser = subparsers.add_parser("wordlist", help="memory used per word form in the Wordlist")
+    wordlist_parser.add_argument("--samplesize", type=int, default=500000, help="number of lexicon lines to load")
+    wordlist_parser.set_defaults(function=bench_wordlist)
+    concurrency_parser = subparsers.add_parser("concurrency", help="many processes sharing one database")
+    concurrency_parser.add_argument("--workers", type=int, default=16, help="number of processes")
+    concurrency_parser.add_argument("--iterations", type=int, default=200, help="lookups and writes per process")
+    concurrency_parser.set_defaults(function=bench_concurrency)
+    lemmas_parser = subparsers.add_parser("lemmas", help="startup time and memory of the lemma tables")
+    lemmas_parser.add_argument("--samplesize", type=int, default=10000, help="number of word forms to look up")
+    lemmas_parser.set_defaults(function=bench_lemmas)
+    tagdistance_parser = subparsers.add_parser("tagdistance", help="speed of the tag distance computation")
+    tagdistance_parser.add_argument("--samplesize", type=int, default=50000, help="number of word forms to rank")
+    tagdistance_parser.set_defaults(function=bench_tagdistance)
+    getaccents_parser = subparsers.add_parser("getaccents", help="share of lemma distances in getaccents")
+    getaccents_parser.add_argument("--samplesize", type=int, default=20000, help="number of word forms")
+    getaccents_parser.set_defaults(function=bench_getaccents)
+    align_parser = subparsers.add_parser("align", help="speed of the alignment in Token.macronize")
+    align_parser.add_argument("--samplesize", type=int, default=100000, help="number of tokens")
+    align_parser.set_defaults(function=bench_align)
+    characters_parser = subparsers.add_parser("characters", help="the character mapping functions")
+    characters_parser.add_argument("--samplesize", type=int, default=100000, help="number of strings")
+    characters_parser.set_defaults(function=bench_characters)
+    args = parser.parse_args()
+    args.function(args)
@@ -2,11 +2,9 @@
 # -*- coding: utf-8 -*-
 
 import postags
+from macronizer import MappedTable, CORPUS_LEMMAS_FILE, LEMMA_FREQUENCIES_FILE
 from collections import defaultdict
 import xml.etree.ElementTree as ET
-import pprint
-
-pp = pprint.PrettyPrinter()
 
 tag_to_accents = defaultdict(list)
 with open('macrons.txt', 'r', encoding='utf-8') as macrons_file, \
@@ -21,8 +19,12 @@ with open('macrons.txt', 'r', encoding='utf-8') as macrons_file, \
         lexicon_file.write("%s\t%s\t%s\n" % (wordform, tag, lemma))
 
 
+# For each tag, the accented endings are ranked longest first. The index maps each ending without markers
+# to the rank and accented form of the first ending that has it, so that the best ending of a word can be
+# found by looking up each of its suffixes.
+max_ending_length = 0
 with open('macronized_endings.py', 'w', encoding='utf-8') as endings_file:
-    endings_file.write('tag_to_endings = {\n')
+    endings_file.write('tag_to_ending_index = {\n')
     for tag in sorted(tag_to_accents):
         ending_freqs = defaultdict(int)
         for accented in tag_to_accents[tag]:
@@ -35,8 +37,15 @@ with open('macronized_endings.py', 'w', encoding='utf-8') as endings_file:
             if ending[0] != ending_without_macrons[0] and ending_freqs[ending] > ending_freqs.get(ending_without_macrons, 1):
                 relevant_endings.append(ending)
         cleaned_list = [str(postags.escape_macrons(ending)) for ending in sorted(relevant_endings, key=lambda x: (-len(x), x))]
-        endings_file.write("  '%s': %s,\n" % (str(tag), cleaned_list))
+        ending_index = {}
+        for (rank, accented_ending) in enumerate(cleaned_list):
+            plain_ending = accented_ending.replace("_", "").replace("^", "")
+            if plain_ending not in ending_index:
+                ending_index[plain_ending] = (rank, accented_ending)
+                max_ending_length = max(max_ending_length, len(plain_ending))
+        endings_file.write("  '%s': %s,\n" % (str(tag), ending_index))
     endings_file.write('}\n')
+    endings_file.write('max_ending_length = %i\n' % max_ending_length)
 
 
 with open('ldt-corpus.txt', 'w', encoding='utf-8') as pos_corpus_file:
@@ -92,7 +101,8 @@ with open('ldt-corpus.txt', 'r', encoding='utf-8') as pos_corpus_file:
             word_lemma_freq[(wordform, lemma)] += 1
             if lemma not in wordform_to_corpus_lemmas[wordform]:
                 wordform_to_corpus_lemmas[wordform].append(lemma)
-with open('lemmas.py', 'w', encoding='utf-8') as lemma_file:
-    lemma_file.write('lemma_frequency = %s\n' % pp.pformat(dict(lemma_frequency)))
-    lemma_file.write('word_lemma_freq = %s\n' % pp.pformat(dict(word_lemma_freq)))
-    lemma_file.write('wordform_to_corpus_lemmas = %s\n' % pp.pformat(dict(wordform_to_corpus_lemmas)))
+# The most frequent lemma of each word form (the first seen, in case of a tie):
+MappedTable.write(CORPUS_LEMMAS_FILE,
+                  ((wordform, max(lemmas, key=lambda lemma: word_lemma_freq[(wordform, lemma)]))
+                   for (wordform, lemmas) in wordform_to_corpus_lemmas.items()))
+MappedTable.write(LEMMA_FREQUENCIES_FILE, ((lemma, str(freq)) for (lemma, freq) in lemma_frequency.items()))
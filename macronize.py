@@ -21,9 +21,11 @@ MACRONIZER_LIB = '.'
 import cgi
 import os
 import sys
+import io
+import contextlib
 import codecs
 sys.path.append(MACRONIZER_LIB)
-from macronizer import Macronizer, evaluate
+from macronizer import Macronizer, Wordlist, evaluate, buildlexiconfile, MACRONS_FILE, LEXICON_FILE, VOCABULARY_FILE
 import unicodedata
 import argparse
 
@@ -34,13 +36,17 @@ SCANSIONS = [
     ["hendecasyllables", [Macronizer.hendecasyllable]],
     ["iambic trimeter + dimeter", [Macronizer.iambictrimeter, Macronizer.iambicdimeter]]
 ]
-TRUNCATETHRESHOLD = 50000  # Set to -1 to disable
+TRUNCATETHRESHOLD = 50000  # Maximum length of texts to scan (prose is macronized and sent in chunks); -1 to disable
 DEBUGCOMMAND = "DEBUG\n"
 
 
 def create_html_page(scriptname, texttomacronize, domacronize, alsomaius, scan, performitoj, performutov, doevaluate):
+    """Generate the page piece by piece. Prose is macronized in chunks (see Macronizer.macronizestream), and each
+    chunk is sent as soon as it is done, so that long texts need neither be truncated nor kept in memory as
+    tokens. Scansion needs the whole text at once, so texts to scan are still truncated."""
     texttomacronize = unicodedata.normalize('NFC', texttomacronize).replace('\r', '')
-    texttomacronize = texttomacronize[:TRUNCATETHRESHOLD]
+    if scan > 0 and TRUNCATETHRESHOLD >= 0:
+        texttomacronize = texttomacronize[:TRUNCATETHRESHOLD]
     if texttomacronize.startswith(DEBUGCOMMAND):
         dodebug = True
         texttomacronize = texttomacronize[len(DEBUGCOMMAND):]
@@ -48,21 +54,19 @@ def create_html_page(scriptname, texttomacronize, domacronize, alsomaius, scan,
         dodebug = False
 
     errormessage = ""
-    if not texttomacronize:
-        macronizedtext = ""
-    else:
+    macronizer = None
+    if texttomacronize:
         try:
             macronizer = Macronizer()
-            macronizer.settext(texttomacronize)
             if scan > 0:
+                macronizer.settext(texttomacronize)
                 macronizer.scan(SCANSIONS[scan][1])
-            macronizedtext = macronizer.gettext(domacronize, alsomaius, performutov, performitoj, markambigs=False)
+                macronizedtext = macronizer.gettext(domacronize, alsomaius, performutov, performitoj, markambigs=False)
         except Exception as inst:
             errormessage = inst.args[0]
-            macronizedtext = ""
+            macronizer = None
 
-    html = []
-    html.append("""<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01//EN" "http://www.w3.org/TR/html4/strict.dtd">
+    yield """<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01//EN" "http://www.w3.org/TR/html4/strict.dtd">
     <html>
     <head>
     <meta http-equiv="Content-Type" content="text/html; charset=utf-8">
@@ -96,7 +100,7 @@ def create_html_page(scriptname, texttomacronize, domacronize, alsomaius, scan,
     </p></form>
     """ % {
         'scriptname': scriptname,
-        'truncatewarning': '' if TRUNCATETHRESHOLD < 0 else '<p>Note: In order to avoid time out from the server, input longer than %s characters will be truncated. Sorry about that!</p>' % TRUNCATETHRESHOLD,
+        'truncatewarning': '' if TRUNCATETHRESHOLD < 0 else '<p>Note: In order to avoid time out from the server, input longer than %s characters will be truncated when scanning. Sorry about that!</p>' % TRUNCATETHRESHOLD,
         'numrows': 20 if not texttomacronize else 3,
         'errormessage': errormessage,
         'domacronize': 'checked' if domacronize else '',
@@ -106,26 +110,48 @@ def create_html_page(scriptname, texttomacronize, domacronize, alsomaius, scan,
         'doevaluate': 'checked' if doevaluate else '',
         'performutov': 'checked' if performutov else '',
         'performitoj': 'checked' if performitoj else '',
-    })
+    } + "\n"
 
-    if macronizedtext:
-        html.append('<h2>Result</h2>')
-        html.append('<p>(Ambiguous forms are marked <span class="ambig">yellow</span>; unknown forms are <span class="unknown">orange</span>. You may click on a vowel to add or remove a macron.)</p>')
+    if macronizer is not None:
+        yield '<h2>Result</h2>\n'
+        yield '<p>(Ambiguous forms are marked <span class="ambig">yellow</span>; unknown forms are <span class="unknown">orange</span>. You may click on a vowel to add or remove a macron.)</p>\n'
+        debuginfo = io.StringIO()
         if scan > 0:
-            html.append('<div class="feet">%s</div>' % '<br>'.join(macronizer.tokenization.scannedfeet))
-        html.append('<div class="prewrap" id="selectme" contenteditable="true">%s</div>' % macronizer.tokenization.detokenize(True))
-        html.append('<p><input id="selecttext" type="button" value="Copy text"></p>')
-
-        if doevaluate:
-            html.append('<h2>Evaluation</h2>')
+            yield '<div class="feet">%s</div>\n' % '<br>'.join(macronizer.tokenization.scannedfeet)
+            yield '<div class="prewrap" id="selectme" contenteditable="true">%s</div>\n' % macronizer.tokenization.detokenize(True)
+            if dodebug:
+                with contextlib.redirect_stdout(debuginfo):
+                    macronizer.tokenization.show()
+        else:
+            macronizedchunks = []
+            yield '<div class="prewrap" id="selectme" contenteditable="true">'
+            try:
+                for macronizedchunk in macronizer.macronizestream([texttomacronize], domacronize, alsomaius,
+                                                                  performutov, performitoj, markambigs=False):
+                    yield macronizer.tokenization.detokenize(True)
+                    if doevaluate:
+                        macronizedchunks.append(macronizedchunk)
+                    if dodebug:
+                        with contextlib.redirect_stdout(debuginfo):
+                            macronizer.tokenization.show()
+            except Exception as inst:
+                errormessage = inst.args[0]
+            yield '</div>\n'
+            if errormessage:
+                yield '<p>%s</p>\n' % errormessage
+            macronizedtext = "".join(macronizedchunks)
+        yield '<p><input id="selecttext" type="button" value="Copy text"></p>\n'
+
+        if doevaluate and not errormessage:
+            yield '<h2>Evaluation</h2>\n'
             (accuracy, evaluatedtext) = evaluate(texttomacronize, macronizedtext)
-            html.append('<div class="prewrap">%s</div>' % evaluatedtext)
-            html.append('<p>Accuracy: %f%%</p>' % (accuracy * 100))
+            yield '<div class="prewrap">%s</div>\n' % evaluatedtext
+            yield '<p>Accuracy: %f%%</p>\n' % (accuracy * 100)
         if dodebug:
-            html.append('<h2>Debug info</h2>')
-            html.append('<pre>%s</pre>' % macronizer.tokenization.show())
+            yield '<h2>Debug info</h2>\n'
+            yield '<pre>%s</pre>\n' % debuginfo.getvalue()
 
-    html.append("""<h2>News</h2>
+    yield """<h2>News</h2>
 
         <p>August 2017: More meters added! The macronizer can now handle hendecasyllables as well as distichs of iambic trimeters and dimeters (<i>Beātus ille quī procul negōtiīs...</i>).</p>
 
@@ -262,9 +288,7 @@ def create_html_page(scriptname, texttomacronize, domacronize, alsomaius, scan,
         };
         </script>
     </body>
-    </html>""")
-
-    return '\n'.join(html)
+    </html>\n"""
 
 
 if 'REQUEST_METHOD' in os.environ:  # If run as a CGI script
@@ -283,7 +307,11 @@ if 'REQUEST_METHOD' in os.environ:  # If run as a CGI script
     performutov = True if htmlform.getvalue('utov') else False
     doevaluate = True if htmlform.getvalue('doevaluate') else False
 
-    print(create_html_page(scriptname, texttomacronize, domacronize, alsomaius, scan, performitoj, performutov, doevaluate))
+    sys.stdout.flush()
+    for htmlpiece in create_html_page(scriptname, texttomacronize, domacronize, alsomaius, scan, performitoj,
+                                      performutov, doevaluate):
+        sys.stdout.write(htmlpiece)
+        sys.stdout.flush()  # Send each macronized chunk as soon as it is done
 
 else:  # Run as a free-standing Python script
     parser = argparse.ArgumentParser()
@@ -299,13 +327,39 @@ else:  # Run as a free-standing Python script
     macrons_group.add_argument("--maius", action="store_true", help="do mark vowels also in māius and such")
     infile_group.add_argument("--test", action="store_true", help="mark vowels in a short example text")
     parser.add_argument("--initialize", action="store_true", help="reset the database (only necessary once)")
+    parser.add_argument("--compactdb", action="store_true", help="convert the database to the compact layout")
+    parser.add_argument("--precrunch", nargs="?", const=VOCABULARY_FILE, metavar="WORDFILE",
+                        help="add the analyses of all words in WORDFILE (default: vocabulary.txt) to the database")
+    parser.add_argument("--jobs", type=int, help="number of Morpheus processes used by --precrunch; default all cores")
+    parser.add_argument("--exportdelta", metavar="DELTAFILE", help="save the words analyzed since --initialize")
+    parser.add_argument("--importdelta", metavar="DELTAFILE", action="append",
+                        help="add words analyzed on another installation (may be repeated)")
+    parser.add_argument("--buildlexicon", action="store_true", help="build the memory mapped lexicon file")
     parser.add_argument("--evaluate", action="store_true", help="test accuracy against input gold standard")
     args = parser.parse_args()
 
-    if args.initialize:
+    if args.initialize or args.compactdb or args.precrunch or args.exportdelta or args.importdelta:
         try:
-            macronizer = Macronizer()
-            macronizer.wordlist.reinitializedatabase()
+            wordlist = Wordlist(multiprocess=False)
+            if args.initialize:
+                wordlist.reinitializedatabase(showprogress=True)
+            if args.compactdb:
+                wordlist.compactdatabase()
+            if args.precrunch:
+                wordlist.precrunchwords(args.precrunch, args.jobs, showprogress=True)
+            if args.importdelta:
+                for deltafilename in args.importdelta:
+                    print("Imported %i parses from %s" % (wordlist.importdelta(deltafilename), deltafilename))
+            if args.exportdelta:
+                print("Exported %i parses to %s" % (wordlist.exportdelta(args.exportdelta), args.exportdelta))
+        except Exception as inst:
+            print(inst.args[0])
+            exit(1)
+        exit(0)
+
+    if args.buildlexicon:
+        try:
+            buildlexiconfile(MACRONS_FILE, LEXICON_FILE)
         except Exception as inst:
             print(inst.args[0])
             exit(1)
@@ -318,7 +372,7 @@ else:  # Run as a free-standing Python script
 
     macronizer = Macronizer()
     if args.test:
-        texttomacronize = "O orbis terrarum te saluto!\n"
+        textpieces = ["O orbis terrarum te saluto!\n"]
     else:
         if args.infile is None:
             if sys.version_info[0] < 3:
@@ -327,28 +381,39 @@ else:  # Run as a free-standing Python script
                 infile = sys.stdin
         else:
             infile = codecs.open(args.infile, 'r', 'utf8')
-        texttomacronize = infile.read()
+        textpieces = infile  # Read line by line
     # endif
-    texttomacronize = unicodedata.normalize('NFC', texttomacronize)
-    macronizer.settext(texttomacronize)
+    textpieces = (unicodedata.normalize('NFC', piece) for piece in textpieces)
     try:
         scan = int(args.scan)
     except:
         scan = 0
-    if scan > 0:
-        macronizer.scan(SCANSIONS[scan][1])
-    macronizedtext = macronizer.gettext(not args.nomacrons, args.maius, args.utov, args.itoj, markambigs=False)
     if args.evaluate:
-        (accuracy, _) = evaluate(texttomacronize, macronizedtext)
-        print("Accuracy: %f" % (accuracy*100))
+        outfile = None
+    elif args.outfile is None:
+        if sys.version_info[0] < 3:
+            outfile = codecs.getwriter('utf8')(sys.stdout)
+        else:
+            outfile = sys.stdout
     else:
-        if args.outfile is None:
-            if sys.version_info[0] < 3:
-                outfile = codecs.getwriter('utf8')(sys.stdout)
-            else:
-                outfile = sys.stdout
+        outfile = codecs.open(args.outfile, 'w', 'utf8')
+    if scan > 0 or args.evaluate:
+        # Scansion and evaluation need the whole text at once:
+        texttomacronize = "".join(textpieces)
+        macronizer.settext(texttomacronize)
+        if scan > 0:
+            macronizer.scan(SCANSIONS[scan][1])
+        macronizedtext = macronizer.gettext(not args.nomacrons, args.maius, args.utov, args.itoj, markambigs=False)
+        if args.evaluate:
+            (accuracy, _) = evaluate(texttomacronize, macronizedtext)
+            print("Accuracy: %f" % (accuracy*100))
         else:
-            outfile = codecs.open(args.outfile, 'w', 'utf8')
-        outfile.write(macronizedtext)
+            outfile.write(macronizedtext)
+    else:
+        # Macronize and write the text a chunk at a time, so that long texts need not be kept in memory:
+        for macronizedtext in macronizer.macronizestream(textpieces, not args.nomacrons, args.maius, args.utov,
+                                                         args.itoj, markambigs=False):
+            outfile.write(macronizedtext)
+            outfile.flush()
     # endif
 # endif
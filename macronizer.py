@@ -18,18 +18,52 @@
 
 import os
 import re
+import sys
+import time
+import mmap
+import struct
+import zlib
+import functools
+import multiprocessing
+import atexit
+import gzip
+import subprocess
+import threading
+import queue
 from tempfile import mkstemp
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import sqlite3
 from html import escape
+from urllib.request import pathname2url
 
 import postags
 
 USE_DB = True
 DB_NAME = 'macronizer.db'
+DB_MULTIPROCESS = False  # Share the database safely between several processes (WAL, read-only lookups, one writer)
+DB_BUSY_TIMEOUT = 10  # Seconds to wait for a lock on the database
+DB_WRITE_ATTEMPTS = 5  # Number of times to try writing, if the database stays locked
+USE_ACCENT_DECISIONS = False  # Remember the ranked accented forms of known words in the database (see Wordlist.accentranking)
 RFTAGGER_DIR = '/usr/local/bin'
 MORPHEUS_DIR = os.path.join(os.path.dirname(__file__), 'morpheus')
 MACRONS_FILE = os.path.join(os.path.dirname(__file__), 'macrons.txt')
+ACCENT_DECISIONS_CORPUS = os.path.join(os.path.dirname(__file__), 'ldt-corpus.txt')  # Seeds the decisions at --initialize
+CORPUS_LEMMAS_FILE = os.path.join(os.path.dirname(__file__), 'lemmas-corpus.tab')  # Written by extractlexicon.py
+LEMMA_FREQUENCIES_FILE = os.path.join(os.path.dirname(__file__), 'lemmas-frequency.tab')
+VOCABULARY_FILE = os.path.join(os.path.dirname(__file__), 'vocabulary.txt')
+USE_LEXICON_FILE = False  # Look up words in a memory mapped file built with --buildlexicon, before the database
+LEXICON_FILE = os.path.join(os.path.dirname(__file__), 'macronizer.lex')
+PERSISTENT_CRUNCHER = True  # Keep one Morpheus cruncher running, instead of starting a new one for every request
+PERSISTENT_TAGGER = True  # Likewise keep RFTagger running, so that the model is loaded only once
+COPROCESS_TIMEOUT = 30  # Seconds to wait for each line of output from a helper program
+WORDLIST_CACHE_SIZE = 200000  # Number of word forms kept in memory between texts; set to -1 to disable eviction
+ALIGNMENT_CACHE_SIZE = 100000  # Number of (plain text, accented form, options) alignments remembered
+LEMMA_DISTANCE_CACHE_SIZE = 100000  # Number of lemma pairs whose edit distance is remembered
+RANKING_CACHE_SIZE = 200000  # Number of ranked accent lists of known words kept between texts; -1 for no limit
+DB_QUERY_CHUNK_SIZE = 500  # Number of word forms looked up per SELECT; keep below SQLite's variable limit
+DB_INSERT_BATCH_SIZE = 10000  # Number of rows inserted at a time when initializing the database
+PRECRUNCH_CHUNK_SIZE = 2000  # Number of words sent to each Morpheus process at a time by --precrunch
+STREAM_CHUNK_SIZE = 20000  # Approximate number of characters macronized at a time by Macronizer.macronizestream
 
 
 def pairwise(iterable):
@@ -38,38 +72,658 @@ def pairwise(iterable):
     return zip(a, a)
 
 
+asciitable = str.maketrans({"æ": "ae", "Æ": "Ae", "œ": "oe", "Œ": "Oe",
+                             "ä": "a", "ë": "e", "ï": "i", "ö": "o", "ü": "u", "ÿ": "u"})
+
+
 def toascii(txt):
-    for source, replacement in [("æ", "ae"), ("Æ", "Ae"), ("œ", "oe"), ("Œ", "Oe"),
-                                ("ä", "a"), ("ë", "e"), ("ï", "i"), ("ö", "o"), ("ü", "u"), ("ÿ", "u")]:
-        txt = txt.replace(source, replacement)
-    return txt
+    if txt.isascii():  # Much faster than translate, and the common case
+        return txt
+    return txt.translate(asciitable)
 
 
 def touiorthography(txt):
-    for source, replacement in [("v", "u"), ("U", "V"), ("j", "i"), ("J", "I")]:
-        txt = txt.replace(source, replacement)
-    return txt
+    # For short ASCII strings, this is faster than both a loop and str.translate:
+    return txt.replace("v", "u").replace("U", "V").replace("j", "i").replace("J", "I")
 
 
 def clean_lemma(lemma):
     return lemma.replace("#", "").replace("1", "").replace(" ", "+").replace("-", "").replace("^", "").replace("_", "")
 
 
-class Wordlist:
+@functools.lru_cache(maxsize=1)
+def endingindex():
+    """The index of macronized endings written by extractlexicon.py: for each tag, a dictionary from each plain
+    ending to its rank and accented form, and the length of the longest plain ending. If macronized_endings.py
+    was written by an older version, with only a ranked list of endings per tag, the index is built from that."""
+    try:
+        from macronized_endings import tag_to_ending_index, max_ending_length
+        return (tag_to_ending_index, max_ending_length)
+    except ImportError:
+        from macronized_endings import tag_to_endings
+    tag_to_ending_index = {}
+    max_ending_length = 0
+    for (tag, accented_endings) in tag_to_endings.items():
+        ending_index = tag_to_ending_index[tag] = {}
+        for (rank, accented_ending) in enumerate(accented_endings):
+            plain_ending = accented_ending.replace("_", "").replace("^", "")
+            if plain_ending not in ending_index:
+                ending_index[plain_ending] = (rank, accented_ending)
+                max_ending_length = max(max_ending_length, len(plain_ending))
+    return (tag_to_ending_index, max_ending_length)
+# enddef
+
+
+def boundedlevenshtein(s1, s2, maxdist):
+    """Return the edit distance between s1 and s2 (with len(s1) >= len(s2)), or None if it is greater than
+    maxdist. Only the cells at most maxdist from the diagonal are computed, and the computation stops as soon
+    as a whole row exceeds maxdist."""
+    toofar = maxdist + 1
+    previous_row = [j if j <= maxdist else toofar for j in range(len(s2) + 1)]
+    for i, c1 in enumerate(s1, 1):
+        current_row = [i if i <= maxdist else toofar] + [toofar] * len(s2)
+        rowmin = current_row[0]
+        for j in range(max(1, i - maxdist), min(len(s2), i + maxdist) + 1):
+            dist = min(previous_row[j] + 1, current_row[j - 1] + 1, previous_row[j - 1] + (c1 != s2[j - 1]), toofar)
+            current_row[j] = dist
+            if dist < rowmin:
+                rowmin = dist
+        if rowmin > maxdist:
+            return None
+        previous_row = current_row
+    return previous_row[-1] if previous_row[-1] <= maxdist else None
+# enddef
+
+
+def levenshtein(s1, s2):
+    """The edit distance between two strings, typically lemmas. Since the distances that matter are small,
+    it is computed within a band around the diagonal, which is widened until the distance fits.
+    Each Wordlist keeps a cached version of it, as lemmadistance."""
+    if s1 == s2:
+        return 0
+    if len(s1) < len(s2):
+        (s1, s2) = (s2, s1)
+    if len(s2) == 0:
+        return len(s1)
+    maxdist = max(1, len(s1) - len(s2))
+    while True:
+        dist = boundedlevenshtein(s1, s2, maxdist)
+        if dist is not None:
+            return dist
+        maxdist *= 2
+# enddef
+
+
+class LRUCache(OrderedDict):
+    """A dictionary which, when trimmed, forgets the least recently used items in excess of maxsize
+    (unless maxsize is -1). It counts hits and misses of lookups, and evictions."""
+
+    def __init__(self, maxsize):
+        OrderedDict.__init__(self)
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    # enddef
+
+    def lookup(self, key, default=None):
+        if key in self:
+            self.hits += 1
+            self.move_to_end(key)
+            return self[key]
+        self.misses += 1
+        return default
+    # enddef
+
+    def store(self, key, value):
+        self[key] = value
+        self.move_to_end(key)
+        self.trim()
+    # enddef
+
+    def trim(self):
+        """Evict the least recently used items, and return their keys."""
+        evicted = []
+        if self.maxsize >= 0:
+            while len(self) > self.maxsize:
+                (key, _) = self.popitem(last=False)
+                evicted.append(key)
+        self.evictions += len(evicted)
+        return evicted
+    # enddef
+
+    def stats(self):
+        return {'size': len(self), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+    # enddef
+# endclass
+
+
+class TagDistances:
+    """The values of postags.tag_distance, kept in a byte array per tag. Tags are numbered in the order they
+    are first seen. Only the pairs of tags actually compared are computed; other cells hold NOTCOMPUTED."""
+    NOTCOMPUTED = 255  # Tags have at most 12 positions
+
+    def __init__(self):
+        self.ids = {}  # Tag -> number
+        self.rows = {}  # Tag -> bytearray of distances to the numbered tags
+    # enddef
+
+    def distance(self, tag1, tag2):
+        tagid = self.ids.get(tag2)
+        if tagid is None:
+            tagid = self.ids[tag2] = len(self.ids)
+        row = self.rows.get(tag1)
+        if row is None:
+            row = self.rows[tag1] = bytearray()
+        if tagid >= len(row):
+            row.extend([TagDistances.NOTCOMPUTED] * (tagid + 1 - len(row)))
+        dist = row[tagid]
+        if dist == TagDistances.NOTCOMPUTED:
+            dist = row[tagid] = postags.tag_distance(tag1, tag2)
+        return dist
+    # enddef
+# endclass
+
+
+class MappedTable:
+    """A read-only table from strings to strings, kept in a file that is memory mapped rather than read, so that
+    opening it is instantaneous and the pages are shared between processes. The records, each of the form
+    key TAB value NEWLINE, are grouped into hash buckets, and the file starts with the offsets of the buckets."""
+    MAGIC = b'MAPTABLE'
+
+    def __init__(self, filename):
+        try:
+            with open(filename, 'rb') as tablefile:
+                self.map = mmap.mmap(tablefile.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            raise Exception("Could not open %s." % filename)
+        if self.map[:len(MappedTable.MAGIC)] != MappedTable.MAGIC:
+            raise Exception("%s is not a valid table file." % filename)
+        (self.size, self.numbuckets) = struct.unpack_from('<II', self.map, len(MappedTable.MAGIC))
+        self.offsetsstart = len(MappedTable.MAGIC) + 8
+        self.recordsstart = self.offsetsstart + 4 * (self.numbuckets + 1)
+    # enddef
+
+    def __len__(self):
+        return self.size
+    # enddef
+
+    def get(self, key, default=None):
+        key = key.encode('utf-8') + b'\t'
+        (start, end) = struct.unpack_from('<II', self.map, self.offsetsstart + 4 * (zlib.crc32(key) % self.numbuckets))
+        for record in self.map[self.recordsstart + start:self.recordsstart + end].split(b'\n'):
+            if record.startswith(key):
+                return record[len(key):].decode('utf-8')
+        return default
+    # enddef
+
+    @staticmethod
+    def write(filename, items):
+        """Write (key, value) pairs to a new table file. The strings must not contain tabs or newlines,
+        and the keys must be unique."""
+        records = [(key.encode('utf-8') + b'\t', value.encode('utf-8')) for (key, value) in items]
+        numbuckets = max(1, len(records))
+        buckets = [[] for _ in range(numbuckets)]
+        for (key, value) in records:
+            buckets[zlib.crc32(key) % numbuckets].append(key + value)
+        with open(filename, 'wb') as tablefile:
+            tablefile.write(MappedTable.MAGIC)
+            tablefile.write(struct.pack('<II', len(records), numbuckets))
+            offset = 0
+            tablefile.write(struct.pack('<I', offset))
+            for bucket in buckets:
+                offset += sum(len(record) + 1 for record in bucket)
+                tablefile.write(struct.pack('<I', offset))
+            for bucket in buckets:
+                for record in bucket:
+                    tablefile.write(record + b'\n')
+    # enddef
+# endclass
+
+
+def buildlexiconfile(macronsfilename, lexiconfilename):
+    """Convert the lexicon to a MappedTable, where every word form is mapped to its parses,
+    each given as "morphtag lemma accented", separated by tabs."""
+    formtoparses = defaultdict(list)
+    with open(macronsfilename, 'r', encoding='utf-8') as plaindbfile:
+        for line in plaindbfile:
+            if line.startswith("#"):
+                continue
+            [wordform, morphtag, lemma, accented] = line.split()
+            parse = "%s %s %s" % (morphtag, lemma, accented)
+            if parse not in formtoparses[wordform]:
+                formtoparses[wordform].append(parse)
+    MappedTable.write(lexiconfilename, ((wordform, "\t".join(parses)) for (wordform, parses) in formtoparses.items()))
+# enddef
+
+
+class Coprocess:
+    """A long-lived helper program, which is fed lines on stdin and answers with lines on stdout.
+    Each request is followed by markerlines, and the answer is read up to the echo of the marker, so that a
+    surplus or missing line is detected, rather than leaking into the answer of the next request. If the program
+    has died, fails to answer in time, or gives the wrong number of lines, it is restarted and the request is
+    retried once."""
+    MARKER = "qqmarkerqq"  # Not a Latin word
+
+    def __init__(self, command, env=None, timeout=COPROCESS_TIMEOUT, markerlines=(MARKER,), nummarkerreplylines=1):
+        self.command = command
+        self.env = env
+        self.timeout = timeout
+        self.markerlines = list(markerlines)
+        self.nummarkerreplylines = nummarkerreplylines  # Number of lines answering markerlines, echo included
+        self.process = None
+        self.output = None
+    # enddef
+
+    def start(self):
+        try:
+            self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=subprocess.DEVNULL, env=self.env, encoding='utf-8', bufsize=1)
+        except OSError:
+            raise Exception("Failed to execute: %s" % " ".join(self.command))
+        # Read the output in a separate thread, so that we can wait for it with a timeout:
+        self.output = queue.Queue()
+        reader = threading.Thread(target=Coprocess.readoutput, args=(self.process.stdout, self.output))
+        reader.daemon = True
+        reader.start()
+    # enddef
+
+    @staticmethod
+    def readoutput(stream, output):
+        for line in stream:
+            output.put(line)
+        output.put(None)  # End of file
+    # enddef
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+        self.output = None
+    # enddef
+
+    def isalive(self):
+        return self.process is not None and self.process.poll() is None
+    # enddef
+
+    def exchange(self, lines, numreplylines):
+        if not self.isalive():
+            self.stop()
+            self.start()
+        try:
+            self.process.stdin.write("".join(line + "\n" for line in lines + self.markerlines))
+            self.process.stdin.flush()
+        except OSError:
+            raise Exception("Failed to communicate with: %s" % " ".join(self.command))
+        replies = []
+        line = self.readline()
+        while line.split("\t")[0].strip() != Coprocess.MARKER:
+            replies.append(line)
+            line = self.readline()
+        for _ in range(self.nummarkerreplylines - 1):
+            self.readline()
+        if len(replies) != numreplylines:
+            raise Exception("Expected %i lines of output, but got %i, from: %s" %
+                            (numreplylines, len(replies), " ".join(self.command)))
+        return replies
+    # enddef
+
+    def readline(self):
+        try:
+            line = self.output.get(timeout=self.timeout)
+        except queue.Empty:
+            raise Exception("Timed out waiting for: %s" % " ".join(self.command))
+        if line is None:
+            raise Exception("Premature end of output from: %s" % " ".join(self.command))
+        return line.rstrip("\n")
+    # enddef
+
+    def communicate(self, lines, numreplylines):
+        """Send the lines to the program, and return the expected number of lines of answer."""
+        try:
+            return self.exchange(lines, numreplylines)
+        except Exception:
+            self.stop()  # Something went wrong; restart the program and try again
+            return self.exchange(lines, numreplylines)
+    # enddef
+# endclass
+
+
+class Cruncher(Coprocess):
+    """The Morpheus cruncher, kept running so that the stem library is loaded only once."""
+
     def __init__(self):
-        self.unknownwords = set()  # Unknown to Morpheus
-        self.formtolemmas = defaultdict(list)
-        self.formtoaccenteds = defaultdict(list)
-        self.formtotaglemmaaccents = defaultdict(list)
+        # The marker is echoed, followed by an (empty) line of analyses:
+        Coprocess.__init__(self, ["stdbuf", "-oL", "%s/bin/cruncher" % MORPHEUS_DIR, "-L"],
+                           env=dict(os.environ, MORPHLIB="%s/stemlib" % MORPHEUS_DIR), nummarkerreplylines=2)
+    # enddef
+
+    def start(self):
+        Coprocess.start(self)
+        if not self.ishealthy():
+            self.stop()
+            raise Exception("Morpheus does not parse 'salve' correctly: %s" % " ".join(self.command))
+    # enddef
+
+    def ishealthy(self):
+        try:
+            [wordform, nl] = self.exchange(["salve"], 2)
+        except Exception:
+            return False
+        return wordform.strip() == "salve" and "<NL>" in nl
+    # enddef
+
+    def crunch(self, words):
+        """Returns the output of Morpheus as a list of lines, two for each word form sent."""
+        lines = []
+        for word in words:
+            lines.append(word.strip().lower())
+            lines.append(word.strip().capitalize())
+        return self.communicate(lines, 2 * len(lines))
+    # enddef
+# endclass
+
+
+class Tagger(Coprocess):
+    """RFTagger, kept running so that the model is loaded only once. Sentences are separated by empty lines."""
+
+    def __init__(self):
+        rftagger_model = os.path.join(os.path.dirname(__file__), 'rftagger-ldt.model')
+        # The marker is sent as a sentence of its own, and is answered with a tagged line and an empty line:
+        Coprocess.__init__(self, ["stdbuf", "-oL", "%s/rft-annotate" % RFTAGGER_DIR, "-s", "-q", rftagger_model],
+                           markerlines=(Coprocess.MARKER, ""), nummarkerreplylines=2)
+    # enddef
+
+    def start(self):
+        Coprocess.start(self)
+        if not self.ishealthy():
+            self.stop()
+            raise Exception("RFTagger does not tag 'salve' correctly: %s" % " ".join(self.command))
+    # enddef
+
+    def ishealthy(self):
+        try:
+            [line, _] = self.exchange(["salve", ""], 2)
+        except Exception:
+            return False
+        return line.startswith("salve\t")
+    # enddef
+
+    def tag(self, lines):
+        """Returns one line of output for each line of input."""
+        if len(lines) > 0 and lines[-1] != "":
+            lines = lines + [""]  # Terminate the last sentence, or the tagger will wait for more
+            return self.communicate(lines, len(lines))[:-1]
+        return self.communicate(lines, len(lines))
+    # enddef
+# endclass
+
+
+def parsecrunchedwords(words, crunchedlines):
+    """Convert the output of Morpheus for the given set of words to a list of (wordform, morphtag, lemma, accented)
+    tuples, where words unknown to Morpheus have None in all but the first position."""
+    crunchedwordforms = {}
+    knownwords = set()
+    newparses = []
+    for wordform, nls in pairwise(crunchedlines):
+        wordform = wordform.strip().lower()
+        nls = nls.strip()
+        crunchedwordforms[wordform] = crunchedwordforms.get(wordform, "") + nls
+    for wordform, nls in crunchedwordforms.items():
+        parses = []
+        for nl in nls.split("<NL>"):
+            nl = nl.replace("</NL>", "")
+            nlparts = nl.split()
+            if len(nlparts) > 0:
+                parses += postags.morpheus_to_parses(wordform, nl)
+        lemmatagtoaccenteds = defaultdict(list)
+        for parse in parses:
+            lemma = clean_lemma(parse[postags.LEMMA])
+            parse[postags.LEMMA] = lemma
+            accented = parse[postags.ACCENTEDFORM]
+            # Work around shortcoming in Morpheus, adding _ in tradu_co_, etc.:
+            if parse[postags.LEMMA].startswith("trans") and accented[3] != "_":
+                accented = accented[:3] + "_" + accented[3:]
+            parse[postags.ACCENTEDFORM] = accented
+            tag = postags.parse_to_ldt(parse)
+            lemmatagtoaccenteds[(lemma, tag)].append(accented)
+        if len(lemmatagtoaccenteds) == 0:
+            continue
+        knownwords.add(wordform)
+        for (lemma, tag), accenteds in lemmatagtoaccenteds.items():
+            # Sometimes there are multiple accented forms; prefer 'volvit' to 'voluit', 'Ju_lius' to 'Iu_lius' etc.:
+            bestaccented = sorted(accenteds, key=lambda x: x.count('v') + x.count('j') + x.count('J'))[-1]
+            lemmatagtoaccenteds[(lemma, tag)] = bestaccented
+        for (lemma, tag), accented in lemmatagtoaccenteds.items():
+            newparses.append((wordform, tag, lemma, accented))
+    # The remaining were unknown to Morpheus:
+    for wordform in words - knownwords:
+        newparses.append((wordform, None, None, None))
+    return newparses
+# enddef
+
+
+def createextratables(dbcursor):
+    """Create the tables crunched and accentdecisions, unless they exist. In a database from before the table
+    crunched was introduced, it is filled with the word forms that are not in MACRONS_FILE, i.e. those that
+    have been added since the database was initialized (if MACRONS_FILE has changed since, this is approximate)."""
+    dbcursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    tables = set(name for (name,) in dbcursor.fetchall())
+    if 'crunched' not in tables:
+        dbcursor.execute("CREATE TABLE IF NOT EXISTS crunched(wordform TEXT PRIMARY KEY) WITHOUT ROWID")
+        if 'morpheus' in tables and os.path.exists(MACRONS_FILE):
+            with open(MACRONS_FILE, 'r', encoding='utf-8') as plaindbfile:
+                initialwords = set(line.split(None, 1)[0] for line in plaindbfile if not line.startswith("#"))
+            dbcursor.execute("SELECT DISTINCT wordform FROM morpheus")
+            dbcursor.executemany("INSERT OR IGNORE INTO crunched (wordform) VALUES (?)",
+                                 [(wordform,) for (wordform,) in dbcursor.fetchall() if wordform not in initialwords])
+    if 'accentdecisions' not in tables:
+        dbcursor.execute('''
+            CREATE TABLE IF NOT EXISTS accentdecisions(
+                wordform TEXT NOT NULL,
+                morphtag TEXT NOT NULL,
+                lemma TEXT NOT NULL,
+                iscapital INTEGER NOT NULL,
+                startssentence INTEGER NOT NULL,
+                accenteds TEXT NOT NULL,
+                PRIMARY KEY(wordform, morphtag, lemma, iscapital, startssentence)
+            ) WITHOUT ROWID
+        ''')
+# enddef
+
+
+def storeparses(dbcursor, compactdb, parses):
+    """Insert (wordform, morphtag, lemma, accented) tuples into the database. Unknown words have None
+    for all but the word form. The word forms are also noted in the table crunched, which thus lists
+    everything that has been added since the database was initialized."""
+    dbcursor.executemany("INSERT OR IGNORE INTO crunched (wordform) VALUES (?)",
+                         [(wordform,) for wordform in set(wordform for (wordform, _, _, _) in parses)])
+    if not compactdb:
+        dbcursor.executemany(
+            "INSERT OR IGNORE INTO morpheus (wordform, morphtag, lemma, accented) VALUES (?, ?, ?, ?)",
+            [parse for parse in parses if parse[3] is not None])
+        # NULLs never collide in a UNIQUE constraint, so check explicitly that unknown words are not already stored:
+        dbcursor.executemany(
+            "INSERT INTO morpheus (wordform) SELECT ? WHERE NOT EXISTS (SELECT 1 FROM morpheus WHERE wordform = ?)",
+            [(wordform, wordform) for (wordform, _, _, accented) in parses if accented is None])
+        return
+    dbcursor.executemany("INSERT OR IGNORE INTO morphtags (morphtag) VALUES (?)",
+                         [(morphtag,) for (_, morphtag, _, _) in parses if morphtag is not None])
+    dbcursor.executemany("INSERT OR IGNORE INTO lemmas (lemma) VALUES (?)",
+                         [(lemma,) for (_, _, lemma, _) in parses if lemma is not None])
+    dbcursor.executemany('''
+        INSERT OR IGNORE INTO morpheus (wordform, tagid, lemmaid, accented) VALUES (?,
+            COALESCE((SELECT id FROM morphtags WHERE morphtag = ?), 0),
+            COALESCE((SELECT id FROM lemmas WHERE lemma = ?), 0),
+            COALESCE(?, ''))
+    ''', parses)
+# enddef
+
+
+def storeaccentdecisions(dbcursor, decisions):
+    """Insert (wordform, morphtag, lemma, iscapital, startssentence, ranking) tuples into the table accentdecisions,
+    where ranking is a tuple of accented forms."""
+    dbcursor.executemany("INSERT OR IGNORE INTO accentdecisions VALUES (?, ?, ?, ?, ?, ?)",
+                         [(wordform, morphtag, lemma, int(iscapital), int(startssentence), "\t".join(ranking))
+                          for (wordform, morphtag, lemma, iscapital, startssentence, ranking) in decisions])
+# enddef
+
+
+class DatabaseWriter:
+    """Stores new parses (and accent decisions) in the database from a background thread, so that several
+    processes can share the database without a request ever waiting for the write lock. Rows queued while
+    a transaction is being written are batched together into the next one, as are the rows of a transaction
+    that failed because the database stayed locked."""
+
+    def __init__(self, dbname):
+        self.dbconn = sqlite3.connect(dbname, timeout=DB_BUSY_TIMEOUT, check_same_thread=False)
+        self.dbconn.execute("PRAGMA journal_mode = WAL")  # Readers do not block the writer, nor vice versa
+        self.compactdb = len(self.dbconn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'morphtags'").fetchall()) > 0
+        createextratables(self.dbconn.cursor())  # The lookup connections are read-only
+        self.dbconn.commit()
+        self.queue = queue.Queue()
+        self.error = None  # The exception that stopped the thread, if any
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)  # Do not lose queued parses when a short-lived process (e.g. CGI) exits
+    # enddef
+
+    def write(self, parses=(), decisions=()):
+        if self.error is not None:
+            raise Exception("The database writer has stopped: %s" % self.error)
+        self.queue.put((parses, decisions))
+    # enddef
+
+    def run(self):
+        try:
+            self.writebatches()
+        except Exception as inst:  # Anything but a locked database; later writes will fail instead of being lost
+            sys.stderr.write("Error: The database writer stopped: %s\n" % inst)
+            self.error = inst
+            raise
+    # enddef
+
+    def writebatches(self):
+        (parsebatch, decisionbatch) = ([], [])  # Rows not yet stored, including those of failed transactions
+        finished = False
+        while not finished:
+            item = self.queue.get()
+            while item is not None:
+                parsebatch += item[0]
+                decisionbatch += item[1]
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            finished = item is None
+            if (parsebatch or decisionbatch) and self.store(parsebatch, decisionbatch):
+                (parsebatch, decisionbatch) = ([], [])
+        if parsebatch or decisionbatch:
+            raise Exception("Could not store %i parses and %i accent decisions in the database." %
+                            (len(parsebatch), len(decisionbatch)))
+    # enddef
+
+    def store(self, parsebatch, decisionbatch):
+        """Write the rows in one transaction, retrying if the database is locked. Returns whether it succeeded."""
+        for attempt in range(DB_WRITE_ATTEMPTS):
+            try:
+                dbcursor = self.dbconn.cursor()
+                if parsebatch:
+                    storeparses(dbcursor, self.compactdb, parsebatch)
+                if decisionbatch:
+                    storeaccentdecisions(dbcursor, decisionbatch)
+                self.dbconn.commit()
+                return True
+            except sqlite3.OperationalError:  # Most likely "database is locked"; wait and try again
+                self.dbconn.rollback()
+                time.sleep(0.1 * 2 ** attempt)
+        sys.stderr.write("Warning: Could not store %i parses and %i accent decisions in the database yet.\n" %
+                         (len(parsebatch), len(decisionbatch)))
+        return False
+    # enddef
+
+    def close(self):
+        """Write the remaining rows, and stop the thread. Raises an exception if some rows could not be stored."""
+        atexit.unregister(self.close)
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.dbconn.close()
+        if self.error is not None:
+            raise Exception("The database writer has stopped: %s" % self.error)
+    # enddef
+# endclass
+
+
+precruncher = None  # The Morpheus process of each --precrunch worker
+
+
+def startprecruncher():
+    global precruncher
+    precruncher = Cruncher()
+# enddef
+
+
+def precrunchchunk(words):
+    return parsecrunchedwords(set(words), precruncher.crunch(words))
+# enddef
+
+
+class Wordlist:
+    def __init__(self, multiprocess=None):
+        # Every loaded word form is mapped to a tuple of (morphtag, lemma, accented) parses, with the tags and
+        # lemmas interned, so that each distinct string is only stored once. Words unknown to Morpheus have
+        # no parses. Words are only evicted if they can be loaded again.
+        self.forms = LRUCache(WORDLIST_CACHE_SIZE if USE_DB or USE_LEXICON_FILE else -1)
+        self.cruncher = None  # Started when first needed
+        self.dbwriter = None
+        self.lexicon = MappedTable(LEXICON_FILE) if USE_LEXICON_FILE else None
+        self.bestlemmas = LRUCache(WORDLIST_CACHE_SIZE)  # Word form -> the lemma chosen by bestlemma
+        # (word form, tag, lemma, is capitalized, starts sentence) -> accented forms, in the order chosen by getaccents:
+        self.rankings = LRUCache(RANKING_CACHE_SIZE)
+        self.tagdistances = TagDistances()
+        self.lemmadistance = functools.lru_cache(maxsize=LEMMA_DISTANCE_CACHE_SIZE)(levenshtein)
+        self.corpuslemmas = None  # Opened when first needed
+        self.lemmafrequencies = None
+        self.newdecisions = None  # Rankings not yet stored in the database, if USE_ACCENT_DECISIONS
+        if multiprocess is None:
+            multiprocess = DB_MULTIPROCESS
+        if USE_DB and multiprocess:
+            # All writes go through the background writer; lookups use a connection that cannot take any locks:
+            self.dbwriter = DatabaseWriter(DB_NAME)
+            self.dbconn = sqlite3.connect("file:%s?mode=ro" % pathname2url(os.path.abspath(DB_NAME)), uri=True,
+                                          timeout=DB_BUSY_TIMEOUT)
+        elif USE_DB:
+            self.dbconn = sqlite3.connect(DB_NAME, timeout=DB_BUSY_TIMEOUT)
         if USE_DB:
-            self.dbconn = sqlite3.connect(DB_NAME)
             self.dbcursor = self.dbconn.cursor()
-        else:
+            self.compactdb = self.iscompactdatabase()
+            if self.dbwriter is None:
+                createextratables(self.dbcursor)
+                self.dbconn.commit()
+            if USE_ACCENT_DECISIONS:
+                self.newdecisions = []
+        elif not USE_LEXICON_FILE:
             self.loadwordsfromfile(MACRONS_FILE)
     # enddef
 
-    def reinitializedatabase(self):
+    def reinitializedatabase(self, showprogress=False):
         self.dbcursor.execute("DROP TABLE IF EXISTS morpheus")
+        self.dbcursor.execute("DROP TABLE IF EXISTS morphtags")
+        self.dbcursor.execute("DROP TABLE IF EXISTS lemmas")
+        self.dbcursor.execute("DROP TABLE IF EXISTS crunched")
+        self.dbcursor.execute("DROP TABLE IF EXISTS accentdecisions")
+        self.compactdb = False
+        createextratables(self.dbcursor)
         self.dbcursor.execute('''
             CREATE TABLE morpheus(
                 id INTEGER PRIMARY KEY, 
@@ -80,65 +734,416 @@ class Wordlist:
                 UNIQUE(wordform, morphtag, lemma, accented)
             )
         ''')
-        self.loadwordsfromfile(MACRONS_FILE, storeindb=True)
+        # The database is built from scratch, so there is no need to guard against crashes while doing so:
+        self.dbcursor.execute("PRAGMA synchronous = OFF")
+        self.dbcursor.execute("PRAGMA journal_mode = MEMORY")
+        self.dbcursor.execute("PRAGMA cache_size = -262144")  # 256 MB
+        self.dbcursor.execute("PRAGMA temp_store = MEMORY")
+        self.storewordsfromfile(MACRONS_FILE, showprogress)
         self.dbcursor.execute("CREATE INDEX morpheus_wordform_index ON morpheus (wordform)")
         self.dbconn.commit()
+        self.dbcursor.execute("PRAGMA journal_mode = DELETE")
+        self.dbcursor.execute("PRAGMA synchronous = FULL")
+        if USE_ACCENT_DECISIONS and os.path.exists(ACCENT_DECISIONS_CORPUS):
+            self.buildaccentdecisions(ACCENT_DECISIONS_CORPUS)
+    # enddef
+
+    def buildaccentdecisions(self, corpusfilename):
+        """Rank the accented forms of the ambiguous words in a tagged corpus (in the format of ldt-corpus.txt),
+        with the tags of the corpus and the lemmas that bestlemma chooses, and store the rankings in the
+        database. Words not in the database are skipped."""
+        keys = set()
+        startssentence = True
+        with open(corpusfilename, 'r', encoding='utf-8') as corpusfile:
+            for line in corpusfile:
+                if '\t' not in line:  # Sentences are separated by empty lines
+                    startssentence = True
+                    continue
+                [wordform, tag, _] = line.strip().split('\t')
+                keys.add((toascii(wordform), tag.replace(".", ""), startssentence))
+                startssentence = False
+        self.loadwordsfromdb(set(wordform.lower() for (wordform, _, _) in keys))
+        decisions = []
+        for (wordform, tag, startssentence) in sorted(keys):
+            if len(set(self.accenteds(wordform.lower()))) > 1:  # Otherwise getaccents has nothing to rank
+                key = (wordform.lower(), tag, self.bestlemma(wordform), wordform.istitle(), startssentence)
+                decisions.append(key + (self.rankaccents(*key),))
+        storeaccentdecisions(self.dbcursor, decisions)
+        self.dbconn.commit()
+    # enddef
+
+    def loadaccentdecisions(self, keys):
+        """Fetch the stored rankings of those of the given (wordform, tag, lemma, iscapital, startssentence)
+        combinations that are not already cached, with a few queries on the word forms."""
+        if self.newdecisions is None:  # Not USE_ACCENT_DECISIONS
+            return
+        keys = set(key for key in keys if key not in self.rankings)
+        wordforms = list(set(key[0] for key in keys))
+        for start in range(0, len(wordforms), DB_QUERY_CHUNK_SIZE):
+            chunk = wordforms[start:start + DB_QUERY_CHUNK_SIZE]
+            self.dbcursor.execute("SELECT * FROM accentdecisions WHERE wordform IN (%s)" % ", ".join("?" * len(chunk)),
+                                  chunk)
+            for (wordform, morphtag, lemma, iscapital, startssentence, accenteds) in self.dbcursor.fetchall():
+                key = (wordform, sys.intern(morphtag), sys.intern(lemma), bool(iscapital), bool(startssentence))
+                if key in keys:
+                    self.rankings[key] = tuple(accenteds.split("\t"))
+    # enddef
+
+    def iscompactdatabase(self):
+        self.dbcursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'morphtags'")
+        return len(self.dbcursor.fetchall()) > 0
+    # enddef
+
+    def compactdatabase(self):
+        """Convert the morpheus table to a more compact layout, where tags and lemmas are stored only once,
+        in separate tables, and the parses are clustered on the word form. Unknown words get tag
+        and lemma id 0 and an empty accented form, since primary key columns cannot be NULL."""
+        if self.compactdb:
+            return
+        self.dbcursor.execute("CREATE TABLE morphtags(id INTEGER PRIMARY KEY, morphtag TEXT NOT NULL UNIQUE)")
+        self.dbcursor.execute("CREATE TABLE lemmas(id INTEGER PRIMARY KEY, lemma TEXT NOT NULL UNIQUE)")
+        self.dbcursor.execute("INSERT INTO morphtags (morphtag) "
+                              "SELECT DISTINCT morphtag FROM morpheus WHERE morphtag IS NOT NULL ORDER BY morphtag")
+        self.dbcursor.execute("INSERT INTO lemmas (lemma) "
+                              "SELECT DISTINCT lemma FROM morpheus WHERE lemma IS NOT NULL ORDER BY lemma")
+        self.dbcursor.execute('''
+            CREATE TABLE morpheus_compact(
+                wordform TEXT NOT NULL,
+                tagid INTEGER NOT NULL,
+                lemmaid INTEGER NOT NULL,
+                accented TEXT NOT NULL,
+                PRIMARY KEY(wordform, tagid, lemmaid, accented)
+            ) WITHOUT ROWID
+        ''')
+        self.dbcursor.execute('''
+            INSERT OR IGNORE INTO morpheus_compact (wordform, tagid, lemmaid, accented)
+            SELECT m.wordform, COALESCE(t.id, 0), COALESCE(l.id, 0), COALESCE(m.accented, '')
+            FROM morpheus AS m
+            LEFT JOIN morphtags AS t ON t.morphtag = m.morphtag
+            LEFT JOIN lemmas AS l ON l.lemma = m.lemma
+            ORDER BY m.wordform
+        ''')
+        self.dbcursor.execute("DROP TABLE morpheus")
+        self.dbcursor.execute("ALTER TABLE morpheus_compact RENAME TO morpheus")
+        self.dbconn.commit()
+        self.dbcursor.execute("VACUUM")
+        self.compactdb = True
     # enddef
 
-    def loadwordsfromfile(self, filename, storeindb=False):
+    def loadwordsfromfile(self, filename):
         with open(filename, 'r', encoding='utf-8') as plaindbfile:
             for line in plaindbfile:
                 if line.startswith("#"):
                     continue
                 [wordform, morphtag, lemma, accented] = line.split()
                 self.addwordparse(wordform, morphtag, lemma, accented)
-                if USE_DB and storeindb:
-                    self.dbcursor.execute(
-                        "INSERT OR IGNORE INTO morpheus (wordform, morphtag, lemma, accented) VALUES (?, ?, ?, ?)",
-                        (wordform, morphtag, lemma, accented))
+    # enddef
+
+    def storewordsfromfile(self, filename, showprogress=False):
+        """Insert all parses in the file into the database, in large batches within a single transaction."""
+        starttime = time.time()
+        rowcount = 0
+        batch = []
+        with open(filename, 'r', encoding='utf-8') as plaindbfile:
+            for line in plaindbfile:
+                if line.startswith("#"):
+                    continue
+                [wordform, morphtag, lemma, accented] = line.split()
+                batch.append((wordform, morphtag, lemma, accented))
+                if len(batch) == DB_INSERT_BATCH_SIZE:
+                    self.dbcursor.executemany(
+                        "INSERT OR IGNORE INTO morpheus (wordform, morphtag, lemma, accented) VALUES (?, ?, ?, ?)", batch)
+                    rowcount += len(batch)
+                    batch = []
+                    if showprogress:
+                        elapsed = time.time() - starttime
+                        sys.stderr.write("\rStored %i rows (%i rows/s)" % (rowcount, rowcount / max(elapsed, 0.001)))
+        self.dbcursor.executemany(
+            "INSERT OR IGNORE INTO morpheus (wordform, morphtag, lemma, accented) VALUES (?, ?, ?, ?)", batch)
+        rowcount += len(batch)
+        if showprogress:
+            elapsed = time.time() - starttime
+            sys.stderr.write("\rStored %i rows in %.1f s (%i rows/s)\n" % (rowcount, elapsed, rowcount / max(elapsed, 0.001)))
+        return rowcount
     # enddef
 
     def loadwords(self, words):  # Expects a set of lowercase words
-        unseenwords = set()
-        for word in words:
-            if word in self.formtotaglemmaaccents:  # Word is already loaded
-                continue
-            if not self.loadwordfromdb(word):  # Could not find word in database
-                unseenwords.add(word)
+        newwords = set(word for word in words if self.forms.lookup(word) is None)  # Skip already loaded words
+        unseenwords = self.loadwordsfromdb(newwords)  # Words that could not be found in the database
         if len(unseenwords) > 0:
-            self.crunchwords(unseenwords)  # Try to parse unseen words with Morpheus, and add result to the database
-            for word in unseenwords:
-                if not self.loadwordfromdb(word):
-                    raise Exception("Could not store %s in the database." % word)
+            # Try to parse unseen words with Morpheus, and add result to the database:
+            newparses = self.crunchwords(unseenwords)
+            if self.dbwriter is not None:  # The parses may not have been written yet
+                for (wordform, morphtag, lemma, accented) in newparses:
+                    self.addwordparse(wordform, morphtag, lemma, accented)
+                return
+            missingwords = self.loadwordsfromdb(unseenwords)
+            if len(missingwords) > 0:
+                raise Exception("Could not store %s in the database." % ", ".join(sorted(missingwords)))
     # enddef
 
-    def loadwordfromdb(self, word):
-        if USE_DB:
+    def trimcache(self):
+        """Forget the least recently used words, if there are more than WORDLIST_CACHE_SIZE of them.
+        This should only be called between texts, since the words of the current text must stay loaded."""
+        self.forms.trim()
+        self.bestlemmas.trim()
+        self.rankings.trim()
+    # enddef
+
+    def cachestats(self):
+        return {'forms': self.forms.stats(), 'lemmas': self.bestlemmas.stats(), 'rankings': self.rankings.stats()}
+    # enddef
+
+    def isunknown(self, wordform):
+        return self.forms.get(wordform) == ()
+    # enddef
+
+    def taglemmaaccents(self, wordform):
+        return self.forms.get(wordform, ())
+    # enddef
+
+    def lemmas(self, wordform):
+        return [lemma for (_, lemma, _) in self.forms.get(wordform, ())]
+    # enddef
+
+    def accenteds(self, wordform):
+        return [accented.lower() for (_, _, accented) in self.forms.get(wordform, ())]
+    # enddef
+
+    def bestlemma(self, wordform):
+        """Return the most likely lemma of the (unaccented) word form: the one most often used with the form
+        in the corpus, or else the parse lemma that is most frequent in the corpus, or else "-".
+        The lowercased form must already have been loaded."""
+        lemma = self.bestlemmas.lookup(wordform)
+        if lemma is None:
+            if self.corpuslemmas is None:
+                self.opencorpuslemmas()
+            lemma = self.corpuslemmas.get(wordform)
+            if lemma is None:
+                lemma = "-"
+                max_freq = -1
+                for lex_lemma in self.lemmas(wordform.lower()):
+                    freq = int(self.lemmafrequencies.get(lex_lemma, 0))
+                    if freq > max_freq:
+                        max_freq = freq
+                        lemma = lex_lemma
+            lemma = sys.intern(lemma)
+            self.bestlemmas.store(wordform, lemma)
+        return lemma
+    # enddef
+
+    def opencorpuslemmas(self):
+        """Open the lemma tables written by extractlexicon.py. If only lemmas.py, written by an older version,
+        is available, the tables are built from it instead, which is slower and takes much more memory."""
+        if os.path.exists(CORPUS_LEMMAS_FILE) and os.path.exists(LEMMA_FREQUENCIES_FILE):
+            self.corpuslemmas = MappedTable(CORPUS_LEMMAS_FILE)
+            self.lemmafrequencies = MappedTable(LEMMA_FREQUENCIES_FILE)
+            return
+        try:
+            from lemmas import lemma_frequency, word_lemma_freq, wordform_to_corpus_lemmas
+        except ImportError:
+            raise Exception("Could not open %s. Please run extractlexicon.py (see INSTALL.txt)." % CORPUS_LEMMAS_FILE)
+        # The most frequent lemma of each word form (the first seen, in case of a tie), as in extractlexicon.py:
+        self.corpuslemmas = dict((wordform, max(lemmas, key=lambda lemma: word_lemma_freq[(wordform, lemma)]))
+                                 for (wordform, lemmas) in wordform_to_corpus_lemmas.items())
+        self.lemmafrequencies = lemma_frequency
+    # enddef
+
+    def rankaccents(self, wordform, tag, lemma, iscapital, startssentence):
+        """Order the distinct accented forms of a known word form, best first, by how well the capitalization,
+        tag and lemma of their parses match those of the token. Only the forms with the best capitalization
+        are included."""
+        candidates = []
+        for (lextag, lexlemma, accented) in self.taglemmaaccents(wordform):
+            # Prefer lemmas with same capitalization as the token, unless the token is at
+            # the start of the sentence and capitalized, in which case any lemma is okay.
+            casedist = 0 if iscapital == lexlemma.istitle() or startssentence and iscapital else 1
+            tagdist = self.tagdistances.distance(tag, lextag)
+            lemdist = self.lemmadistance(lemma, lexlemma)
+            candidates.append((casedist, tagdist, lemdist, accented))
+        candidates.sort()
+        ranking = []
+        for (casedist, tagdist, lemdist, accented) in candidates:
+            if accented not in ranking and casedist == candidates[0][0]:
+                ranking.append(accented)
+        return tuple(ranking)
+    # enddef
+
+    def accentranking(self, wordform, tag, lemma, iscapital, startssentence):
+        """Like rankaccents, but each combination of arguments is only ranked once. With USE_ACCENT_DECISIONS,
+        the rankings are also kept in the database, so that they outlive the process; those of a text should
+        be fetched beforehand with loadaccentdecisions."""
+        key = (wordform, tag, lemma, iscapital, startssentence)
+        ranking = self.rankings.lookup(key)
+        if ranking is None:
+            ranking = self.rankaccents(*key)
+            self.rankings[key] = ranking
+            if self.newdecisions is not None:
+                self.newdecisions.append(key + (ranking,))
+        return ranking
+    # enddef
+
+    def storenewaccentdecisions(self):
+        if not self.newdecisions:
+            return
+        if self.dbwriter is not None:
+            self.dbwriter.write(decisions=self.newdecisions)
+        else:
+            storeaccentdecisions(self.dbcursor, self.newdecisions)
+            self.dbconn.commit()
+        self.newdecisions = []
+    # enddef
+
+    def loadwordsfromdb(self, words):
+        """Look up all the given word forms using a few set-based queries. Returns the set of missing words."""
+        if self.lexicon is not None:
+            words = self.loadwordsfromlexicon(words)
+        if not USE_DB:
+            for word in words:
+                self.addwordparse(word, None, None, None)
+            return set()
+        words = list(words)
+        foundwords = set()
+        for start in range(0, len(words), DB_QUERY_CHUNK_SIZE):
+            chunk = words[start:start + DB_QUERY_CHUNK_SIZE]
+            if self.compactdb:
+                query = "SELECT m.wordform, t.morphtag, l.lemma, NULLIF(m.accented, '') FROM morpheus AS m " \
+                        "LEFT JOIN morphtags AS t ON t.id = m.tagid LEFT JOIN lemmas AS l ON l.id = m.lemmaid " \
+                        "WHERE m.wordform IN (%s)"
+            else:
+                query = "SELECT wordform, morphtag, lemma, accented FROM morpheus WHERE wordform IN (%s)"
             try:
-                self.dbcursor.execute(
-                    "SELECT wordform, morphtag, lemma, accented FROM morpheus WHERE wordform = ?", (word,))
+                self.dbcursor.execute(query % ", ".join("?" * len(chunk)), chunk)
             except Exception:
                 raise Exception("Database table is missing. Please reset the database using --initialize.")
-            rows = self.dbcursor.fetchall()
-            if len(rows) == 0:
-                return False
-            for [wordform, morphtag, lemma, accented] in rows:
+            for [wordform, morphtag, lemma, accented] in self.dbcursor.fetchall():
                 self.addwordparse(wordform, morphtag, lemma, accented)
-        else:
-            self.addwordparse(word, None, None, None)
-        return True
+                foundwords.add(wordform)
+        return set(words) - foundwords
+    # enddef
+
+    def loadwordsfromlexicon(self, words):
+        """Look up the word forms in the lexicon file. Returns the set of words not found there."""
+        missingwords = set()
+        for word in words:
+            parses = self.lexicon.get(word)
+            if parses is None:
+                missingwords.add(word)
+                continue
+            for parse in parses.split("\t"):
+                [morphtag, lemma, accented] = parse.split(" ")
+                self.addwordparse(word, morphtag, lemma, accented)
+        return missingwords
+    # enddef
+
+    def loadwordfromdb(self, word):
+        return len(self.loadwordsfromdb([word])) == 0
     # enddef
 
     def addwordparse(self, wordform, morphtag, lemma, accented):
+        parses = self.forms.get(wordform, ())
         if accented is None:
-            self.unknownwords.add(wordform)
+            self.forms[wordform] = parses
         else:
-            self.formtolemmas[wordform].append(lemma)
-            self.formtoaccenteds[wordform].append(accented.lower())
-            self.formtotaglemmaaccents[wordform].append((morphtag, lemma, accented))
+            self.forms[wordform] = parses + ((sys.intern(morphtag), sys.intern(lemma), accented),)
     # enddef
 
     def crunchwords(self, words):
+        if PERSISTENT_CRUNCHER:
+            if self.cruncher is None:
+                self.cruncher = Cruncher()
+            crunchedlines = self.cruncher.crunch(words)
+        else:
+            crunchedlines = self.crunchwordsonce(words)
+        newparses = parsecrunchedwords(words, crunchedlines)
+        if self.dbwriter is not None:
+            self.dbwriter.write(newparses)
+        else:
+            self.storewordparses(newparses)
+            self.dbconn.commit()
+        return newparses
+    # enddef
+
+    def precrunchwords(self, filename, numprocesses=None, showprogress=False):
+        """Run all words in the file (one per line) through Morpheus, using several processes in parallel, and store
+        the results in the database, so that this need not be done when the words are encountered in a text.
+        Words already in the database are skipped, so an interrupted run can simply be restarted."""
+        with open(filename, 'r', encoding='utf-8') as wordfile:
+            words = set(toascii(line.strip()).lower() for line in wordfile if line.strip())
+        self.dbcursor.execute("SELECT DISTINCT wordform FROM morpheus")
+        words.difference_update(wordform for (wordform,) in self.dbcursor)
+        words = sorted(words)
+        chunks = [words[start:start + PRECRUNCH_CHUNK_SIZE] for start in range(0, len(words), PRECRUNCH_CHUNK_SIZE)]
+        starttime = time.time()
+        donecount = 0
+        pool = multiprocessing.Pool(numprocesses, initializer=startprecruncher)
+        try:
+            for (chunk, newparses) in zip(chunks, pool.imap(precrunchchunk, chunks)):
+                self.storewordparses(newparses)
+                self.dbconn.commit()  # Commit each chunk, so that the work done is kept if interrupted
+                donecount += len(chunk)
+                if showprogress:
+                    elapsed = time.time() - starttime
+                    sys.stderr.write("\rCrunched %i of %i words (%i words/s)" %
+                                     (donecount, len(words), donecount / max(elapsed, 0.001)))
+        finally:
+            pool.terminate()
+        if showprogress:
+            sys.stderr.write("\n")
+    # enddef
+
+    def exportdelta(self, filename):
+        """Write all parses added to the database since it was initialized (by Morpheus or by importdelta) to a
+        compressed file, in the same format as macrons.txt; unknown words are given without any parse."""
+        if self.compactdb:
+            self.dbcursor.execute("SELECT m.wordform, t.morphtag, l.lemma, NULLIF(m.accented, '') "
+                                  "FROM crunched AS c JOIN morpheus AS m ON m.wordform = c.wordform "
+                                  "LEFT JOIN morphtags AS t ON t.id = m.tagid LEFT JOIN lemmas AS l ON l.id = m.lemmaid")
+        else:
+            self.dbcursor.execute("SELECT m.wordform, m.morphtag, m.lemma, m.accented "
+                                  "FROM crunched AS c JOIN morpheus AS m ON m.wordform = c.wordform")
+        rowcount = 0
+        with gzip.open(filename, 'wt', encoding='utf-8') as deltafile:
+            deltafile.write("# Parses added to the macronizer database\n")
+            for (wordform, morphtag, lemma, accented) in self.dbcursor:
+                if accented is None:
+                    deltafile.write("%s\n" % wordform)
+                else:
+                    deltafile.write("%s %s %s %s\n" % (wordform, morphtag, lemma, accented))
+                rowcount += 1
+        return rowcount
+    # enddef
+
+    def importdelta(self, filename):
+        """Add the parses in a file written by exportdelta to the database. Parses already present are skipped,
+        so the same file can safely be imported more than once."""
+        rowcount = 0
+        batch = []
+        with gzip.open(filename, 'rt', encoding='utf-8') as deltafile:
+            for line in deltafile:
+                if line.startswith("#"):
+                    continue
+                fields = line.split()
+                if len(fields) == 1:
+                    batch.append((fields[0], None, None, None))
+                else:
+                    [wordform, morphtag, lemma, accented] = fields
+                    batch.append((wordform, morphtag, lemma, accented))
+                if len(batch) == DB_INSERT_BATCH_SIZE:
+                    self.storewordparses(batch)
+                    rowcount += len(batch)
+                    batch = []
+        self.storewordparses(batch)
+        rowcount += len(batch)
+        self.dbconn.commit()
+        return rowcount
+    # enddef
+
+    def storewordparses(self, parses):
+        storeparses(self.dbcursor, self.compactdb, parses)
+    # enddef
+
+    def crunchwordsonce(self, words):
         morphinpfd, morphinpfname = mkstemp()
         os.close(morphinpfd)
         crunchedfd, crunchedfname = mkstemp()
@@ -156,45 +1161,17 @@ class Wordlist:
         with open(crunchedfname, 'r', encoding='utf-8') as crunchedfile:
             morpheus = crunchedfile.read()
         os.remove(crunchedfname)
-        crunchedwordforms = {}
-        knownwords = set()
-        for wordform, nls in pairwise(morpheus.split("\n")):
-            wordform = wordform.strip().lower()
-            nls = nls.strip()
-            crunchedwordforms[wordform] = crunchedwordforms.get(wordform, "") + nls
-        for wordform, nls in crunchedwordforms.items():
-            parses = []
-            for nl in nls.split("<NL>"):
-                nl = nl.replace("</NL>", "")
-                nlparts = nl.split()
-                if len(nlparts) > 0:
-                    parses += postags.morpheus_to_parses(wordform, nl)
-            lemmatagtoaccenteds = defaultdict(list)
-            for parse in parses:
-                lemma = clean_lemma(parse[postags.LEMMA])
-                parse[postags.LEMMA] = lemma
-                accented = parse[postags.ACCENTEDFORM]
-                # Work around shortcoming in Morpheus, adding _ in tradu_co_, etc.:
-                if parse[postags.LEMMA].startswith("trans") and accented[3] != "_":
-                    accented = accented[:3] + "_" + accented[3:]
-                parse[postags.ACCENTEDFORM] = accented
-                tag = postags.parse_to_ldt(parse)
-                lemmatagtoaccenteds[(lemma, tag)].append(accented)
-            if len(lemmatagtoaccenteds) == 0:
-                continue
-            knownwords.add(wordform)
-            for (lemma, tag), accenteds in lemmatagtoaccenteds.items():
-                # Sometimes there are multiple accented forms; prefer 'volvit' to 'voluit', 'Ju_lius' to 'Iu_lius' etc.:
-                bestaccented = sorted(accenteds, key=lambda x: x.count('v') + x.count('j') + x.count('J'))[-1]
-                lemmatagtoaccenteds[(lemma, tag)] = bestaccented
-            for (lemma, tag), accented in lemmatagtoaccenteds.items():
-                self.dbcursor.execute("INSERT OR IGNORE INTO morpheus (wordform, morphtag, lemma, accented) VALUES (?, ?, ?, ?)",
-                                      (wordform, tag, lemma, accented))
-        # The remaining were unknown to Morpheus:
-        for wordform in words - knownwords:
-            self.dbcursor.execute("INSERT OR IGNORE INTO morpheus (wordform) VALUES (?)", (wordform,))
+        return morpheus.split("\n")
+    # enddef
 
-        self.dbconn.commit()
+    def close(self):
+        if self.cruncher is not None:
+            self.cruncher.stop()
+            self.cruncher = None
+        if self.dbwriter is not None:
+            dbwriter = self.dbwriter
+            self.dbwriter = None
+            dbwriter.close()  # Raises an exception if some parses could not be stored
     # enddef
 # endclass
 
@@ -203,15 +1180,143 @@ prefixeswithshortj = ("bij", "fidej", "Foroj", "foroj", "ju_rej", "multij", "pra
                       "rej", "retroj", "se_mij", "sesquij", "u_nij", "introj")
 
 
+def alignedcharacter(p, a, performutov, performitoj):
+    """The character of the result for a plain character p aligned with an accented character a."""
+    if performutov and a.lower() == 'v' and p == 'u':
+        return 'v'
+    elif performutov and a.lower() == 'v' and p == 'U':
+        return 'V'
+    elif performitoj and a.lower() == 'j' and p == 'i':
+        return 'j'
+    elif performitoj and a.lower() == 'j' and p == 'I':
+        return 'J'
+    return p
+# enddef
+
+
+def alignaccentedlinear(plain, accented, domacronize, performutov, performitoj):
+    """Align the plain text and the accented form letter by letter, which is possible in the common case that
+    they differ only in the macrons, the case, u/v or i/j. Otherwise return None. The result is the same as
+    that of alignaccenteddp."""
+    result = []
+    i = 0
+    for a in accented:
+        if a == '_':
+            if domacronize and i > 0:  # Like alignaccenteddp, ignore macrons before the first letter
+                result.append('_')
+            continue
+        if i == len(plain):
+            return None
+        p = plain[i]
+        i += 1
+        if toascii(p.lower()) != toascii(a.lower()):
+            letters = "IJij" if p in "IJij" else "UVuv"
+            if a not in letters or p not in letters:
+                return None
+            # Next to another i/j or u/v, e.g. plain "uv" with "vu", some other alignment may cost the same:
+            if i > 1 and plain[i - 2] in letters or i < len(plain) and plain[i] in letters:
+                return None
+        result.append(alignedcharacter(p, a, performutov, performitoj))
+    if i != len(plain):
+        return None
+    return "".join(result)
+# enddef
+
+
+def alignaccenteddp(plain, accented, domacronize, performutov, performitoj):
+    """Align the plain text and the accented form by finding the cheapest sequence of edits, using a single
+    flat array for the cost matrix."""
+    n = len(plain) + 1
+    m = len(accented) + 1
+    plainfolded = [toascii(p.lower()) for p in plain]
+    accentedfolded = [toascii(a.lower()) for a in accented]
+    distance = [0] * (n * m)
+    for i in range(1, n):
+        distance[i * m] = distance[(i - 1) * m] + 2  # Deletion
+    for j in range(1, m):
+        distance[j] = distance[j - 1] + (0 if accented[j - 1] == '_' else 2)  # Insertion
+    for i in range(1, n):
+        p = plain[i - 1]
+        pfolded = plainfolded[i - 1]
+        row = i * m
+        previousrow = row - m
+        for j in range(1, m):
+            a = accented[j - 1]
+            if pfolded == accentedfolded[j - 1]:
+                distance[row + j] = distance[previousrow + j - 1]
+            else:
+                rghtcost = distance[previousrow + j] + 2
+                if a == '_':
+                    diagcost = distance[previousrow + j - 1] + 100
+                    downcost = distance[row + j - 1]
+                else:
+                    diagcost = distance[previousrow + j - 1] + (
+                        1 if (a in "IJij" and p in "IJij") or (a in "UVuv" and p in "UVuv") else 2)
+                    downcost = distance[row + j - 1] + 2
+                distance[row + j] = min(rghtcost, diagcost, downcost)
+    result = []
+    (i, j) = (n - 1, m - 1)
+    while i != 0 and j != 0:
+        upcost = distance[i * m + j - 1]
+        diagcost = distance[(i - 1) * m + j - 1]
+        leftcost = distance[(i - 1) * m + j]
+        if diagcost <= upcost and diagcost < leftcost:  # To-do: review the comparisons...
+            i -= 1
+            j -= 1
+            result.append(alignedcharacter(plain[i], accented[j], performutov, performitoj))
+        elif upcost <= diagcost and upcost <= leftcost:
+            j -= 1
+            if domacronize and accented[j] == '_':
+                result.append("_")
+        else:
+            i -= 1
+            result.append(plain[i])
+    return "".join(reversed(result))
+# enddef
+
+
+def alignaccented(plain, accented, domacronize, performutov, performitoj):
+    """Transfer the macrons (and, optionally, the v and j) of the accented form to the plain text of a token."""
+    result = alignaccentedlinear(plain, accented, domacronize, performutov, performitoj)
+    if result is None:
+        result = alignaccenteddp(plain, accented, domacronize, performutov, performitoj)
+    # Some strange morpheus output (e.g. de_e_recti_) may give an additional _ in the result:
+    return result.replace("__", "_")
+# enddef
+
+
+alignments = LRUCache(ALIGNMENT_CACHE_SIZE)  # Results of alignaccented, shared by all tokens
+
+
 class Token:
+    # Texts are tokenized into very many of these, so they are kept small:
+    __slots__ = ('tag', 'lemma', 'accented', 'macronized', 'text', 'asciitext', 'asciilower', 'lowertext', 'iscapital',
+                 'isupper', 'taggertext', 'isword', 'isspace', 'hasenclitic', 'isenclitic', 'startssentence',
+                 'endssentence', 'isunknown')
+
+    noaccents = ("",)  # Shared by all tokens until getaccents gives the words lists of their own
+
     def __init__(self, text):
         self.tag = ""
         self.lemma = ""
-        self.accented = [""]
+        self.accented = Token.noaccents
         self.macronized = ""
-        self.text = postags.removemacrons(text)
         self.isword = True if re.match("[^\W\d_]", text, flags=re.UNICODE) else False
         self.isspace = True if re.match("\s", text, flags=re.UNICODE) else False
+        if not self.isword and text.isascii():
+            # Whitespace, punctuation and numbers recur constantly, and have no letters to normalize:
+            self.text = self.asciitext = self.asciilower = self.lowertext = self.taggertext = sys.intern(text)
+            self.iscapital = False
+            self.isupper = True
+        else:
+            self.text = postags.removemacrons(text)
+            # The normalized forms of the text used by the different stages:
+            self.asciitext = toascii(self.text)
+            self.lowertext = self.text if self.text.islower() else self.text.lower()  # Share the string if possible
+            self.asciilower = self.lowertext if self.asciitext is self.text else self.asciitext.lower()
+            self.iscapital = self.asciitext.istitle()
+            self.isupper = self.text == self.text.upper()
+            self.taggertext = toascii(self.lowertext) if self.isupper else self.asciitext  # As given to RFTagger
         self.hasenclitic = False
         self.isenclitic = False
         self.startssentence = False
@@ -230,7 +1335,7 @@ class Token:
     # enddef
 
     def show(self):
-        print("\t".join([self.text, self.tag, self.lemma, self.accented[0]])).expandtabs(16)
+        print("\t".join([self.text, self.tag, self.lemma, self.accented[0]]).expandtabs(16))
     # enddef
 
     def macronize(self, domacronize, alsomaius, performutov, performitoj):
@@ -246,7 +1351,7 @@ class Token:
         if (not domacronize or "_" not in accented) and not performutov and not performitoj:
             self.macronized = plain
             return
-        if self.isenclitic and not (plain.lower() == "ue" and performutov):
+        if self.isenclitic and not (self.lowertext == "ue" and performutov):
             self.macronized = plain
             return
         if plain == accented.replace("_", ""):
@@ -257,86 +1362,75 @@ class Token:
             return
         # endif
 
-        def inscost(a):
-            if a == '_':
-                return 0
-            return 2
-
-        def subcost(p, a):
-            if a == '_':
-                return 100
-            if (a in "IJij" and p in "IJij") or (a in "UVuv" and p in "UVuv"):
-                return 1
-            return 2
-
-        def delcost(_):
-            return 2
-
-        n = len(plain) + 1
-        m = len(accented) + 1
-        distance = [[0 for i in range(m)] for j in range(n)]
-        for i in range(1, n):
-            distance[i][0] = distance[i-1][0] + delcost(plain[i-1])
-        for j in range(1, m):
-            distance[0][j] = distance[0][j-1] + inscost(accented[j-1])
-        for i in range(1, n):
-            for j in range(1, m):
-                if toascii(plain[i-1].lower()) == toascii(accented[j-1].lower()):
-                    distance[i][j] = distance[i-1][j-1]
-                else:
-                    rghtcost = distance[i-1][j] + delcost(plain[i-1])
-                    diagcost = distance[i-1][j-1] + subcost(plain[i-1], accented[j-1])
-                    downcost = distance[i][j-1] + inscost(accented[j-1])
-                    distance[i][j] = min(rghtcost, diagcost, downcost)
-        result = ""
-        while i != 0 and j != 0:
-            upcost = distance[i][j-1] if j > 0 else 1000
-            diagcost = distance[i-1][j-1] if j > 0 and i > 0 else 1000
-            leftcost = distance[i-1][j] if i > 0 else 1000
-            if diagcost <= upcost and diagcost < leftcost:  # To-do: review the comparisons...
-                i -= 1
-                j -= 1
-                if performutov and accented[j].lower() == 'v' and plain[i] == 'u':
-                    result = 'v' + result
-                elif performutov and accented[j].lower() == 'v' and plain[i] == 'U':
-                    result = 'V' + result
-                elif performitoj and accented[j].lower() == 'j' and plain[i] == 'i':
-                    result = 'j' + result
-                elif performitoj and accented[j].lower() == 'j' and plain[i] == 'I':
-                    result = 'J' + result
-                else:
-                    result = plain[i] + result
-            elif upcost <= diagcost and upcost <= leftcost:
-                j -= 1
-                if domacronize and accented[j] == '_':
-                    result = "_" + result
-            else:
-                i -= 1
-                result = plain[i] + result
-        # Some strange morpheus output (e.g. de_e_recti_) may give an additional _ in the result:
-        result = result.replace("__", "_")
+        # The same alignments recur constantly, within and across texts:
+        key = (plain, accented, domacronize, performutov, performitoj)
+        result = alignments.lookup(key)
+        if result is None:
+            result = alignaccented(plain, accented, domacronize, performutov, performitoj)
+            alignments.store(key, result)
         self.macronized = result
     # enddef
 # endclass
 
 
+# This does not work?: [^\W\d_]+|\s+|([^\w\s]|[\d_])+
+chunkpattern = re.compile("[^\W\d_]+|\s+|[^\w\s]+|[\d_]+", re.UNICODE)
+
+
+def markedchunks(text, start=0, state=(False, True)):
+    """Split the text into words, whitespace, punctuation and numbers, and yield each chunk with its end offset
+    in the text, whether it starts or ends a sentence, and the state of the tokenizer after it. Tokenizing can be
+    resumed at the end of any chunk but the last (which might continue in text not yet read), given that state."""
+    (possiblesentenceend, sentencehasended) = state
+    for match in chunkpattern.finditer(text, start):
+        chunk = match.group()
+        (startssentence, endssentence) = (False, False)
+        if re.match("[^\W\d_]", chunk, flags=re.UNICODE):
+            if sentencehasended:
+                startssentence = True
+            sentencehasended = False
+            possiblesentenceend = (len(chunk) > 1)
+        elif possiblesentenceend and any(i in chunk for i in '.;:?!'):
+            endssentence = True
+            possiblesentenceend = False
+            sentencehasended = True
+        yield (chunk, match.end(), startssentence, endssentence, (possiblesentenceend, sentencehasended))
+# enddef
+
+
+def sentencechunks(textpieces, chunksize=STREAM_CHUNK_SIZE):
+    """Join the pieces of a text (e.g. the lines of a file) and cut the result into chunks, each at the first
+    sentence end found by markedchunks at least chunksize characters into it, so that each chunk is tokenized
+    just like it would be as part of the whole text. Where no sentence ends, the text is cut at whitespace
+    instead, once the chunk is four times longer than chunksize. Each character is tokenized only once,
+    apart from the last, possibly incomplete, chunk of every piece."""
+    text = ""
+    chunkstart = 0  # Offset in text of the chunk to be yielded next
+    (scanned, state) = (0, (False, True))  # Offset in text up to which it has been tokenized, and the state there
+    for piece in textpieces:
+        if chunkstart > 0:
+            (text, scanned, chunkstart) = (text[chunkstart:], scanned - chunkstart, 0)
+        text += piece
+        for (chunk, end, _, endssentence, newstate) in markedchunks(text, scanned, state):
+            if end == len(text):  # The last chunk might continue in the next piece
+                break
+            (scanned, state) = (end, newstate)
+            if endssentence and end - chunkstart >= chunksize or \
+                    chunk.isspace() and end - chunkstart >= 4 * chunksize:
+                yield text[chunkstart:end]
+                chunkstart = end
+    if chunkstart < len(text):
+        yield text[chunkstart:]
+# enddef
+
+
 class Tokenization:
     def __init__(self, text):
         self.tokens = []
-        possiblesentenceend = False
-        sentencehasended = True
-        # This does not work?: [^\W\d_]+|\s+|([^\w\s]|[\d_])+
-        for chunk in re.findall("[^\W\d_]+|\s+|[^\w\s]+|[\d_]+", text, re.UNICODE):
+        for (chunk, _, startssentence, endssentence, _) in markedchunks(text):
             token = Token(chunk)
-            if token.isword:
-                if sentencehasended:
-                    token.startssentence = True
-                sentencehasended = False
-                possiblesentenceend = (len(token.text) > 1)
-            elif possiblesentenceend and any(i in token.text for i in '.;:?!'):
-                token.endssentence = True
-                possiblesentenceend = False
-                sentencehasended = True
+            token.startssentence = startssentence
+            token.endssentence = endssentence
             self.tokens.append(token)
         self.scannedfeet = []
     # enddef
@@ -345,7 +1439,7 @@ class Tokenization:
         words = set()
         for token in self.tokens:
             if token.isword:
-                words.add(toascii(token.text).lower())
+                words.add(token.asciilower)
         return words
     # enddef
 
@@ -373,9 +1467,9 @@ class Tokenization:
         newtokens = []
         for oldtoken in self.tokens:
             tobeadded = []
-            oldlc = oldtoken.text.lower()
+            oldlc = oldtoken.lowertext
             if oldtoken.isword and oldlc != "que" and (
-                            oldlc in wordlist.unknownwords or oldlc in ["nec", "neque", "necnon", "seque", "seseque",
+                            wordlist.isunknown(oldlc) or oldlc in ["nec", "neque", "necnon", "seque", "seseque",
                                                                         "quique", "mecumque", "tecumque", "secumque"]):
                 if oldlc == "nec":
                     tobeadded = oldtoken.split(1, True)
@@ -393,7 +1487,7 @@ class Tokenization:
                 newtokens.append(oldtoken)
             else:
                 for part in tobeadded:
-                    newwords.add(toascii(part.text).lower())
+                    newwords.add(part.asciilower)
                     newtokens.append(part)
         self.tokens = newtokens
         return newwords
@@ -409,148 +1503,118 @@ class Tokenization:
             print("... (truncated) ...")
     # enddef
 
-    def addtags(self):
+    def addtags(self, tagger=None):
+        taggerinput = []
+        savedencliticbearer = None
+        for token in self.tokens:
+            if not token.isspace:
+                if token.hasenclitic:
+                    savedencliticbearer = token.taggertext
+                    continue
+                taggerinput.append(token.taggertext)
+                if token.isenclitic:
+                    assert savedencliticbearer is not None
+                    taggerinput.append(savedencliticbearer)
+                    savedencliticbearer = None
+            if token.endssentence:
+                taggerinput.append("")
+        if tagger is None:
+            taggeroutput = self.tagonce(taggerinput)
+        else:
+            taggeroutput = tagger.tag(taggerinput)
+        fromtagger = iter(taggeroutput)
+        (taggedenclititoken, enclitictag) = (None, None)
+        line = None
+        for token in self.tokens:
+            if not token.isspace:
+                try:
+                    if token.hasenclitic:
+                        line = next(fromtagger, "").strip()
+                        assert line
+                        assert line.count('\t') == 1
+                        (taggedenclititoken, enclitictag) = line.split("\t")
+                    if token.isenclitic:
+                        assert taggedenclititoken is not None
+                        assert enclitictag is not None
+                        (taggedtoken, tag) = (taggedenclititoken, enclitictag)
+                    else:
+                        line = next(fromtagger, "").strip()
+                        assert line
+                        assert line.count('\t') == 1
+                        (taggedtoken, tag) = line.split('\t')
+                    assert taggedtoken == token.taggertext
+                except AssertionError:
+                    raise Exception("Error: Could not handle tagging data:\n'%s'" %
+                                    ("Premature End Of File." if not line else line))
+                # endtry
+                token.tag = tag.replace(".", "")
+            if token.endssentence:
+                line = next(fromtagger, "")
+    # enddef
+
+    @staticmethod
+    def tagonce(taggerinput):
         totaggerfd, totaggerfname = mkstemp()
         os.close(totaggerfd)
         fromtaggerfd, fromtaggerfname = mkstemp()
         os.close(fromtaggerfd)
-        savedencliticbearer = None
         with open(totaggerfname, 'w', encoding='utf-8') as totaggerfile:
-            for token in self.tokens:
-                if not token.isspace:
-                    tokentext = token.text
-                    if tokentext == tokentext.upper():
-                        tokentext = tokentext.lower()
-                    if token.hasenclitic:
-                        savedencliticbearer = toascii(tokentext)
-                        continue
-                    totaggerfile.write(toascii(tokentext) + "\n")
-                    if token.isenclitic:
-                        assert savedencliticbearer is not None
-                        totaggerfile.write(savedencliticbearer + "\n")
-                        savedencliticbearer = None
-                if token.endssentence:
-                    totaggerfile.write("\n")
+            for line in taggerinput:
+                totaggerfile.write(line + "\n")
         rftagger_model = os.path.join(os.path.dirname(__file__), 'rftagger-ldt.model')
         rft_command = "%s/rft-annotate -s -q %s %s %s" % (RFTAGGER_DIR, rftagger_model, totaggerfname, fromtaggerfname)
         exitcode = os.system(rft_command)
         if exitcode != 0:
             raise Exception("Failed to execute: %s" % rft_command)
         with open(fromtaggerfname, 'r', encoding='utf-8') as fromtaggerfile:
-            (taggedenclititoken, enclitictag) = (None, None)
-            line = None
-            for token in self.tokens:
-                if not token.isspace:
-                    try:
-                        if token.hasenclitic:
-                            line = fromtaggerfile.readline().strip()
-                            assert line
-                            assert line.count('\t') == 1
-                            (taggedenclititoken, enclitictag) = line.split("\t")
-                        if token.isenclitic:
-                            assert taggedenclititoken is not None
-                            assert enclitictag is not None
-                            (taggedtoken, tag) = (taggedenclititoken, enclitictag)
-                        else:
-                            line = fromtaggerfile.readline().strip()
-                            assert line
-                            assert line.count('\t') == 1
-                            (taggedtoken, tag) = line.split('\t')
-                        if token.text == token.text.upper():
-                            assert taggedtoken == toascii(token.text.lower())
-                        else:
-                            assert taggedtoken == toascii(token.text)
-                    except AssertionError:
-                        raise Exception("Error: Could not handle tagging data in file %s:\n'%s'" %
-                                        (fromtaggerfname, "Premature End Of File." if not line else line))
-                    # endtry
-                    token.tag = tag.replace(".", "")
-                if token.endssentence:
-                    line = fromtaggerfile.readline()
+            taggeroutput = fromtaggerfile.read().split("\n")
         os.remove(totaggerfname)
         os.remove(fromtaggerfname)
+        return taggeroutput
     # enddef
 
     def addlemmas(self, wordlist):
-        from lemmas import lemma_frequency, word_lemma_freq, wordform_to_corpus_lemmas
         for token in self.tokens:
-            wordform = toascii(token.text)
-            best_lemma = "-"
-            max_freq = -1
-            if wordform in wordform_to_corpus_lemmas:
-                for corpus_lemma in wordform_to_corpus_lemmas[wordform]:
-                    if word_lemma_freq[(wordform, corpus_lemma)] > max_freq:
-                        max_freq = word_lemma_freq[(wordform, corpus_lemma)]
-                        best_lemma = corpus_lemma
-            elif wordform.lower() in wordlist.formtolemmas:
-                for lex_lemma in wordlist.formtolemmas[wordform.lower()]:
-                    if lemma_frequency.get(lex_lemma, 0) > max_freq:
-                        max_freq = lemma_frequency.get(lex_lemma, 0)
-                        best_lemma = lex_lemma
-            # endif
-            token.lemma = best_lemma
+            token.lemma = wordlist.bestlemma(token.asciitext)
     # enddef
 
     def getaccents(self, wordlist):
+        (tag_to_ending_index, max_ending_length) = endingindex()
 
-        def levenshtein(s1, s2):
-            if len(s1) < len(s2):
-                return levenshtein(s2, s1)
-            if len(s2) == 0:
-                return len(s1)
-            previous_row = range(len(s2) + 1)
-            for i, c1 in enumerate(s1):
-                current_row = [i + 1]
-                for j, c2 in enumerate(s2):
-                    insertions = previous_row[j + 1] + 1
-                    deletions = current_row[j] + 1
-                    substitutions = previous_row[j] + (c1 != c2)
-                    current_row.append(min(insertions, deletions, substitutions))
-                previous_row = current_row
-            return previous_row[-1]
-        # enddef
-
-        from macronized_endings import tag_to_endings
-
+        toberanked = []
         for token in self.tokens:
             if not token.isword:
                 continue
-            wordform = toascii(token.text)
-            iscapital = wordform.istitle()
-            wordform = wordform.lower()
+            wordform = token.asciilower
+            iscapital = token.iscapital
             tag = token.tag
             lemma = token.lemma
             if token.isenclitic:
-                token.accented = ["ve"] if token.text.lower() == "ue" else [token.text.lower()]
-            elif token.text.lower() == "ne" and token.hasenclitic:  # Not nēque...
+                token.accented = ["ve"] if token.lowertext == "ue" else [token.lowertext]
+            elif token.lowertext == "ne" and token.hasenclitic:  # Not nēque...
                 token.accented = ["ne"]
-            elif len(set(wordlist.formtoaccenteds[wordform])) == 1:
-                token.accented = [wordlist.formtoaccenteds[wordform][0]]
-            elif wordform in wordlist.formtotaglemmaaccents:
-                candidates = []
-                for (lextag, lexlemma, accented) in wordlist.formtotaglemmaaccents[wordform]:
-                    # Prefer lemmas with same capitalization as the token, unless the token is at
-                    # the start of the sentence and capitalized, in which case any lemma is okay.
-                    casedist = 0 if iscapital == lexlemma.istitle() or token.startssentence and iscapital else 1
-                    tagdist = postags.tag_distance(tag, lextag)
-                    lemdist = levenshtein(lemma, lexlemma)
-                    candidates.append((casedist, tagdist, lemdist, accented))
-                candidates.sort()
-                token.accented = []
-                for (casedist, tagdist, lemdist, accented) in candidates:
-                    if accented not in token.accented and casedist == candidates[0][0]:
-                        token.accented.append(accented)
+            elif len(set(wordlist.accenteds(wordform))) == 1:
+                token.accented = [wordlist.accenteds(wordform)[0]]
+            elif wordlist.taglemmaaccents(wordform):
+                toberanked.append((token, (wordform, tag, lemma, iscapital, token.startssentence)))
             else:
                 # Unknown word, but attempt to mark vowels in ending:
                 # To-do: Better support for different capitalization and orthography
                 token.accented = [token.text]
                 if any(i in token.text for i in "aeiouyAEIOUY"):
-                    for accented_ending in tag_to_endings.get(tag, []):
-                        plain_ending = accented_ending.replace("_", "").replace("^", "")
-                        if wordform.endswith(plain_ending):
-                            token.accented = [wordform[:-len(plain_ending)] + accented_ending]
-                            break
+                    # Of the endings in the index that the word has, use the one ranked first:
+                    ending_index = tag_to_ending_index.get(tag, {})
+                    best = None
+                    for i in range(1, min(len(wordform), max_ending_length) + 1):
+                        match = ending_index.get(wordform[-i:])
+                        if match is not None and (best is None or match[0] < best[0]):
+                            best = match + (i,)
+                    if best is not None:
+                        token.accented = [wordform[:-best[2]] + best[1]]
                     token.isunknown = True
+        wordlist.loadaccentdecisions(key for (_, key) in toberanked)
+        for (token, key) in toberanked:
+            token.accented = list(wordlist.accentranking(*key))  # A copy, since the list may be reordered later
     # enddef
 
     def scanverses(self, meterautomatons):
@@ -762,7 +1826,7 @@ class Tokenization:
                 else:
                     followingsegment = "CC"
                 if token.isunknown:
-                    token.accented.append(allvowelsambiguous(token.text.lower()))
+                    token.accented.append(allvowelsambiguous(token.lowertext))
                 verse.append((index, possiblescans(token.accented, followingsegment)))
             if "\n" in token.text or index == len(self.tokens) - 1:
                 (accentcorrections, feet) = scanverse(verse, meterautomatons[automatonindex])
@@ -1004,17 +2068,27 @@ class Macronizer:
 
     def __init__(self):
         self.wordlist = Wordlist()
+        self.tagger = Tagger() if PERSISTENT_TAGGER else None
         self.tokenization = Tokenization("")
     # enddef
 
+    def close(self):
+        """Stop the helper programs kept running between requests."""
+        self.wordlist.close()
+        if self.tagger is not None:
+            self.tagger.stop()
+    # enddef
+
     def settext(self, text):
+        self.wordlist.trimcache()
         self.tokenization = Tokenization(text)
         self.wordlist.loadwords(self.tokenization.allwordforms())
         newwordforms = self.tokenization.splittokens(self.wordlist)
         self.wordlist.loadwords(newwordforms)
-        self.tokenization.addtags()
+        self.tokenization.addtags(self.tagger)
         self.tokenization.addlemmas(self.wordlist)
         self.tokenization.getaccents(self.wordlist)
+        self.wordlist.storenewaccentdecisions()
     # enddef
 
     def scan(self, automatons):
@@ -1030,6 +2104,16 @@ class Macronizer:
         self.settext(text)
         return self.gettext(domacronize, alsomaius, performutov, performitoj, markambigs)
     # enddef
+
+    def macronizestream(self, textpieces, domacronize=True, alsomaius=False, performutov=False, performitoj=False,
+                        markambigs=False):
+        """Macronize a text given as an iterable of pieces (e.g. a file, line by line), and yield the result
+        progressively. The text is handled in chunks cut at sentence ends (see sentencechunks), so that memory use
+        does not grow with the length of the text. After each chunk is yielded, self.tokenization holds its tokens.
+        Scansion is not supported, since verses and meters do not follow sentence boundaries."""
+        for text in sentencechunks(textpieces):
+            yield self.macronize(text, domacronize, alsomaius, performutov, performitoj, markambigs)
+    # enddef
 # endclass
 
 